@@ -0,0 +1,62 @@
+""" Measures how long it takes to import geemake in a fresh interpreter.
+
+Each statement is run in a new python process so that nothing is cached
+between repeats, the median wall time of each is printed as JSON. The geemap
+and ee statements show what importing geemake cost when it imported and
+initialized geemap eagerly, statements whose package is not installed are
+reported as null.
+
+Usage:
+    PYTHONPATH=src python benchmarks/import_time.py [--repeats N]
+"""
+import argparse
+import importlib.util
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+STATEMENTS = {
+    'geemake.geemake': 'from geemake import geemake',
+    'geemake.utils': 'from geemake import utils',
+    'ee': 'import ee',
+    'geemap': 'import geemap',
+}
+
+# the packages that statements need which geemake does not depend on
+OPTIONAL = {'geemap': 'geemap'}
+
+
+def time_statement(statement, repeats):
+    """ Returns the median seconds taken to run statement in a new process.
+    """
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', statement], check=True)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    baseline = time_statement('pass', args.repeats)
+    results = {}
+    for name, statement in STATEMENTS.items():
+        if name in OPTIONAL and \
+                importlib.util.find_spec(OPTIONAL[name]) is None:
+            results[name] = None
+            continue
+        results[name] = max(
+            0.0, time_statement(statement, args.repeats) - baseline
+        )
+    results['interpreter'] = baseline
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+""" Compares joining a local table row by row with geemake.joins.join.
+
+The row by row approach is the one in
+tests/mixed_ee_and_non_ee_rules/add_census_info.py: one
+`collection.filter(ee.Filter.eq(...)).first()` per row of the table. For
+tables of every size both computations are built against the fake earth
+engine backend (see geemake.fake) and the time taken to build them and the
+number of filters and joins in them are reported as JSON. The fake cannot
+run the computations, how long earth engine takes to run them is not
+measured. Neither is the size of what is sent to earth engine: the fake
+writes out every reference to a shared subexpression in full, where earth
+engine's serializer writes it once, so its sizes would be misleading.
+
+Usage:
+    PYTHONPATH=src python benchmarks/joins.py --rows 10 100 1000 10000
+"""
+import argparse
+import json
+import sys
+import tempfile
+import time
+
+import ee
+
+from geemake import fake, joins
+
+ASSET = 'users/geemake/benchmark/cities'
+
+
+def census(rows):
+    return [
+        {'name': f'city-{i}', 'population': 1000 * i} for i in range(rows)
+    ]
+
+
+def row_by_row(table):
+    collection = ee.FeatureCollection(ASSET)
+    cities = []
+    for row in table:
+        city = collection.filter(ee.Filter.eq('name', row['name'])).first()
+        cities.append(city.set('population', row['population']))
+    return ee.FeatureCollection(cities)
+
+
+def join(table):
+    return joins.join(ASSET, table, on='name')
+
+
+def measure(build, table):
+    """ Builds a computation.
+
+    Returns:
+        dict: build_time (seconds) and the number of filters and joins in
+        the computation.
+    """
+    start = time.perf_counter()
+    computation = build(table)
+    build_time = time.perf_counter() - start
+    serialized = computation.serialize()
+    return {
+        'build_time': build_time,
+        'filters': serialized.count('"Filter.'),
+        'joins': serialized.count('"Join.'),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument('--rows', type=int, nargs='+',
+                        default=[10, 100, 1000])
+    parser.add_argument('--output', help='write the results to this file')
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        with fake.backend({'path': f'{directory}/fake-ee.sqlite'}):
+            for rows in args.rows:
+                table = census(rows)
+                result = {
+                    'rows': rows,
+                    'row_by_row': measure(row_by_row, table),
+                    'join': measure(join, table),
+                }
+                print(json.dumps(result), file=sys.stderr)
+                results.append(result)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
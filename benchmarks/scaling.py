@@ -0,0 +1,314 @@
+""" Measures how geemake scales with the size of a workflow.
+
+Synthetic workflows with N rules, M earth engine inputs per rule and K tasks
+per create_tasks are generated and run against the fake earth engine backend
+(see geemake.fake). For every size the following stages are measured, each
+in a fresh python process:
+
+    initialize: geemake.initialize on the generated rules.
+    initialize_rerun: geemake.initialize again, once the local files exist.
+    wrapper: wrapper.py running one rule that creates K tasks.
+    dry_run: `snakemake -n` on the generated Snakefile (with --dry-run).
+
+For each stage the wall time, the number of requests made to earth engine
+(per operation), the peak RSS of the process tree and the largest number of
+processes alive at once are reported as JSON.
+
+Usage:
+    PYTHONPATH=src python benchmarks/scaling.py --rules 10 100 1000 10000 \\
+        --inputs 2 --tasks 1 10 100 --output scaling.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WRAPPER = os.path.join(ROOT, 'geemake', 'wrapper.py')
+
+EE_PREFIX = 'users/geemake/benchmark/'
+LOCAL_PREFIX = '.local/'
+
+RULE_SCRIPT = '''import ee
+
+
+def create_tasks(inputs, outputs):
+    collections = [ee.FeatureCollection(x) for x in inputs]
+    collection = ee.FeatureCollection(collections)
+    collection = collection.flatten()
+    return [
+        (output, ee.batch.Export.table.toAsset(
+            collection=collection,
+            description=f'benchmark_{i}',
+            assetId=output,
+        ))
+        for i, output in enumerate(outputs)
+    ]
+'''
+
+
+def workflow(rules, inputs, tasks):
+    """ Returns the inputs and outputs of every rule in a synthetic workflow.
+
+    The first rule only reads true inputs, every later rule reads the first
+    output of the rule before it as well as true inputs, so that the local
+    files are a mix of true inputs and intermediate results.
+
+    Args:
+        rules: int, number of rules.
+        inputs: int, number of earth engine inputs per rule.
+        tasks: int, number of outputs (and therefore tasks) per rule.
+
+    Returns:
+        list of (list of str, list of str), the local input and output files
+        of each rule.
+    """
+    spec = []
+    for i in range(rules):
+        rule_inputs = [f'{LOCAL_PREFIX}input-{i}-{j}' for j in range(inputs)]
+        if i > 0 and inputs > 0:
+            rule_inputs[0] = spec[-1][1][0]
+        rule_outputs = [f'{LOCAL_PREFIX}output-{i}-{k}' for k in range(tasks)]
+        spec.append((rule_inputs, rule_outputs))
+    return spec
+
+
+def write_workflow(directory, spec, fake_options):
+    """ Writes a Snakefile, config and rule script for spec into directory.
+    """
+    config = {
+        'ee_prefix': EE_PREFIX,
+        'local_prefix': LOCAL_PREFIX,
+        'ee_fake': fake_options,
+    }
+    with open(os.path.join(directory, 'config.yaml'), 'w') as f:
+        json.dump(config, f)  # json is valid yaml
+    with open(os.path.join(directory, 'create_tasks.py'), 'w') as f:
+        f.write(RULE_SCRIPT)
+
+    wrapper = 'file:' + os.path.relpath(os.path.dirname(WRAPPER), directory)
+    with open(os.path.join(directory, 'snakefile'), 'w') as f:
+        f.write('configfile: "config.yaml"\n\n')
+        all_outputs = [x for _, outputs in spec for x in outputs]
+        f.write('rule all:\n')
+        f.write(f'    input: {all_outputs}\n\n')
+        for i, (rule_inputs, rule_outputs) in enumerate(spec):
+            f.write(f'rule rule_{i}:\n')
+            f.write(f'    input: {rule_inputs}\n')
+            f.write(f'    output: {rule_outputs}\n')
+            f.write('    params:\n')
+            f.write('        script="create_tasks.py",\n')
+            f.write('        wait=0,\n')
+            f.write(f'    wrapper:\n        "{wrapper}"\n\n')
+        f.write('from geemake import geemake\n')
+        f.write('geemake.initialize(list(workflow.rules), config)\n')
+
+
+def _descendants(pid):
+    """ Returns the ids of every process descended from pid (linux only). """
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    found = []
+    stack = [pid]
+    while stack:
+        for child in children.get(stack.pop(), []):
+            found.append(child)
+            stack.append(child)
+    return found
+
+
+def measure(command, directory, env):
+    """ Runs command and measures its time, peak RSS and process count.
+
+    Args:
+        command: list of str, the command to run.
+        directory: str, the working directory of the command.
+        env: dict, the environment of the command.
+
+    Returns:
+        dict: wall_time (seconds), peak_rss (kilobytes) and peak_processes
+        of the command, and the JSON it printed on its last line (if any).
+    """
+    with tempfile.TemporaryFile('w+') as out, \
+            tempfile.TemporaryFile('w+') as err:
+        start = time.perf_counter()
+        process = subprocess.Popen(
+            command, cwd=directory, env=env, stdout=out, stderr=err,
+        )
+        peak = [1]
+        done = threading.Event()
+
+        def sample():
+            while not done.is_set():
+                peak[0] = max(peak[0], 1 + len(_descendants(process.pid)))
+                done.wait(0.05)
+
+        sampler = threading.Thread(target=sample, daemon=True)
+        sampler.start()
+        # wait4 rather than wait so that the resource usage of this child
+        # alone is known
+        _, status, usage = os.wait4(process.pid, 0)
+        wall_time = time.perf_counter() - start
+        done.set()
+        sampler.join()
+        process.returncode = os.waitstatus_to_exitcode(status)
+
+        out.seek(0)
+        err.seek(0)
+        stdout = out.read()
+        if process.returncode != 0:
+            raise RuntimeError(f'{" ".join(command)} failed:\n{err.read()}')
+
+    result = {
+        'wall_time': wall_time,
+        'peak_rss': usage.ru_maxrss,
+        'peak_processes': peak[0],
+    }
+    lines = stdout.strip().splitlines()
+    if lines and lines[-1].startswith('{'):
+        result.update(json.loads(lines[-1]))
+    return result
+
+
+def _stage(stage, directory, spec):
+    """ Runs one stage in this process, called in a fresh interpreter. """
+    from types import SimpleNamespace
+
+    from geemake import fake, geemake, session
+
+    with open(os.path.join(directory, 'config.yaml')) as f:
+        config = json.load(f)
+    session.configure(config)
+    session.initialize()
+    before = fake.call_counts()
+
+    if stage in ('initialize', 'initialize_rerun'):
+        rules = [SimpleNamespace(input=i, output=o) for i, o in spec]
+        geemake.initialize(rules, config)
+    elif stage == 'wrapper':
+        rule_inputs, rule_outputs = spec[-1]
+        snakemake = SimpleNamespace(
+            rule=f'rule_{len(spec) - 1}',
+            input=rule_inputs,
+            output=rule_outputs,
+            params={'script': 'create_tasks.py', 'wait': 0, 'max_wait': 1},
+            config=config,
+            log_fmt_shell=lambda **kwargs: '',
+        )
+        with open(WRAPPER) as f:
+            code = compile(f.read(), WRAPPER, 'exec')
+        exec(code, {'__name__': '__main__', 'snakemake': snakemake})
+
+    after = fake.call_counts()
+    calls = {k: v - before.get(k, 0) for k, v in after.items()}
+    calls = {k: v for k, v in calls.items() if v}
+    print(json.dumps({'calls': calls, 'total_calls': sum(calls.values())}))
+
+
+def run(rules, inputs, tasks, dry_run=False, fake_options=None):
+    """ Benchmarks one workflow size.
+
+    Returns:
+        dict: the size of the workflow and the measurements of each stage.
+    """
+    spec = workflow(rules, inputs, tasks)
+    with tempfile.TemporaryDirectory() as directory:
+        options = dict(fake_options or {})
+        options['path'] = os.path.join(directory, 'fake-ee.sqlite')
+        write_workflow(directory, spec, options)
+
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(
+            [os.path.join(ROOT, 'src'), env.get('PYTHONPATH', '')]
+        )
+        env['GEEMAKE_FAKE_EE'] = json.dumps(options)
+
+        # create the true inputs of the workflow
+        from geemake import fake
+        with fake.backend(options):
+            outputs = {x for _, o in spec for x in o}
+            for rule_inputs, _ in spec:
+                for local in rule_inputs:
+                    if local not in outputs:
+                        fake.create_asset(
+                            local.replace(LOCAL_PREFIX, EE_PREFIX)
+                        )
+
+        spec_file = os.path.join(directory, 'spec.json')
+        with open(spec_file, 'w') as f:
+            json.dump(spec, f)
+
+        result = {'rules': rules, 'inputs': inputs, 'tasks': tasks}
+        # initialize_rerun is the common case, every local file exists
+        stages = ['initialize', 'initialize_rerun', 'wrapper']
+        for stage in stages:
+            command = [
+                sys.executable, os.path.abspath(__file__),
+                '--stage', stage, directory, spec_file,
+            ]
+            result[stage] = measure(command, directory, env)
+        if dry_run:
+            result['dry_run'] = measure(
+                ['snakemake', '-n', '-c1', '--quiet'], directory, env
+            )
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument('--rules', type=int, nargs='+', default=[10, 100])
+    parser.add_argument('--inputs', type=int, nargs='+', default=[2])
+    parser.add_argument('--tasks', type=int, nargs='+', default=[1, 10])
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds every fake request takes')
+    parser.add_argument('--task-duration', type=float, default=0.5)
+    parser.add_argument('--dry-run', action='store_true',
+                        help='also time `snakemake -n` on each workflow')
+    parser.add_argument('--output', help='write the results to this file')
+    parser.add_argument('--stage', nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.stage:
+        stage, directory, spec_file = args.stage
+        with open(spec_file) as f:
+            spec = json.load(f)
+        _stage(stage, directory, spec)
+        return
+
+    fake_options = {
+        'latency': args.latency,
+        'task_duration': args.task_duration,
+    }
+    results = []
+    for rules in args.rules:
+        for inputs in args.inputs:
+            for tasks in args.tasks:
+                result = run(rules, inputs, tasks, args.dry_run, fake_options)
+                print(json.dumps(result), file=sys.stderr)
+                results.append(result)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
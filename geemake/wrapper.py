@@ -1,16 +1,21 @@
-import importlib.util
-import time
+from geemake import daemon
+
+# snakemake sets __file__ to the path of the wrapper, or to its URL if it is
+# not a local file, in which case the job runs here
+if snakemake.config.get("ee_daemon") and not daemon.serving() and \
+        daemon.submit(__file__, snakemake):
+    # the job ran in the daemon, see geemake.daemon
+    raise SystemExit(0)
+
+import itertools
 import os
-from multiprocessing import Process
+import time
 
 from snakemake.io import InputFiles, OutputFiles
 
-from geemake import utils
+from geemake import benchmarks, cache, client, quota, session, tasks, utils
 
 import ee
-import geemap
-
-geemap.ee_initialize()
 
 extra = snakemake.params.get("extra", "")
 log = snakemake.log_fmt_shell(stdout=True, stderr=True)
@@ -19,47 +24,349 @@ ee_prefix = snakemake.config.get("ee_prefix", "")
 local_prefix = snakemake.config.get("local_prefix", ".local")
 script = snakemake.params.get("script", "")
 wait = snakemake.params.get("wait", 10)
+max_wait = snakemake.params.get(
+    "max_wait",
+    snakemake.config.get("ee_max_wait", tasks.DEFAULT_MAX_WAIT),
+)
+window = snakemake.params.get(
+    "max_in_flight",
+    snakemake.config.get("ee_max_in_flight", tasks.DEFAULT_WINDOW),
+)
+skip_unchanged = snakemake.config.get("ee_skip_unchanged", False)
+early_cutoff = snakemake.config.get("ee_early_cutoff", False)
+cache_prefix = snakemake.config.get("ee_cache_prefix", "").rstrip("/")
+max_workers = snakemake.config.get("ee_max_workers", utils.DEFAULT_MAX_WORKERS)
+# the length of the longest chain of rules this one starts, see initialize
+priority = utils.read_priorities().get(snakemake.rule, 0)
 
+session.configure(snakemake.config)
+cache.configure(snakemake.config)
+client.configure(snakemake.config, snakemake.rule)
+quota.configure(snakemake.config)
+benchmarks.configure(snakemake.config)
 
-def poll(asset, local, task):
-    task.start()
+# places in the workflow wide queue for a task slot, see geemake.quota
+tickets = {}
+# hashes of each task and the inputs it reads, see utils.task_fingerprint
+fingerprints = {}
+# tasks started by an interrupted run to resume, by asset, see reattach
+resumed = {}
+started_at = {}
+# expected runtimes of the tasks that have been queued
+expected = {}
+# final statuses of the tasks that have finished, for geemake.benchmarks
+statuses = {}
 
-    status = None
+# seconds between reports of how many tasks have finished
+PROGRESS_INTERVAL = 30
+progress = {'started': 0, 'finished': 0, 'failed': 0, 'reported': time.time()}
 
-    while True:
-        time.sleep(wait)
 
-        status = task.status()['state']
-        if status == 'READY' or status == 'RUNNING':
-            continue
-        elif status == 'COMPLETED':
-            utils.write_update_time(asset, local)
-            break
-        else:
-            print(f'Task to create {asset} ended with status: {status}')
-            break
+def report():
+    print(
+        f'{snakemake.rule}: {progress["finished"]} of {progress["started"]} '
+        f'started tasks finished, {progress["failed"]} of them failed'
+    )
+    progress['reported'] = time.time()
+
+
+def start(item):
+    asset, _, task = item
+    if asset in resumed:
+        print(f'Resuming task {resumed[asset]} creating {asset}')
+        progress['started'] += 1
+        return resumed.pop(asset)
+    if asset not in tickets:
+        tickets[asset] = quota.enqueue(priority)
+    if not quota.try_acquire(tickets[asset]):
+        return None
+
+    # only tasks of Cloud projects have a priority, it is set after the
+    # fingerprint is taken so that it does not change the fingerprint
+    if priority and session.project():
+        tasks.set_priority(task, priority)
+    client.start_task(task, target=asset)
+    cache.put_submitted(asset, task.id, fingerprints[asset], time.time())
+    progress['started'] += 1
+    return task.id
+
+
+def finish(item, status, runtime):
+    asset, local, _ = item
+    expected.pop(item, None)
+    task_status = statuses.pop(item, {})
+    progress['finished'] += 1
+    progress['failed'] += status != 'COMPLETED'
+    if time.time() - progress['reported'] > PROGRESS_INTERVAL:
+        report()
+    quota.release(tickets.pop(asset))
+    cache.remove_submitted(asset)
+    size = None
+    if status == 'COMPLETED':
+        update_time = utils.write_update_time(asset, local)
+        cache.put_runtime(asset, runtime)
+        cache.put_fingerprint(asset, fingerprints[asset], update_time)
+        if cache_prefix:
+            publish(asset)
+        size = (utils.read_content(local) or {}).get('sizeBytes')
+    else:
+        print(f'Task to create {asset} ended with status: {status}')
+    # failed tasks are recorded too, they may have used EECUs
+    benchmarks.record(snakemake.rule, asset, task_status, runtime, size,
+                      snakemake.params.get("ee_benchmark"))
 
 
 def swap_prefix(x):
-    return x.replace(local_prefix, ee_prefix)
+    # files named with the ee:// storage plugin hold their asset's full id
+    return utils.storage_asset(x) or x.replace(local_prefix, ee_prefix)
 
 
-inputs = InputFiles(toclone=snakemake.input, custom_map=swap_prefix)
-outputs = OutputFiles(toclone=snakemake.output, custom_map=swap_prefix)
+def skip_unchanged_tasks(created):
+    """ Rewrites the local files of outputs whose tasks would not change them
+    and returns the remaining tasks.
+
+    An output is unchanged if the task that created it had the same
+    fingerprint and the asset has not been modified since.
+    """
+    previous = cache.get_fingerprints(fingerprints)
+    candidates = [
+        (asset, local) for asset, local, _ in created
+        if previous.get(asset, (None,))[0] == fingerprints[asset]
+    ]
+    if not candidates:
+        return created
+    update_times = utils.get_update_times(
+        [asset for asset, _ in candidates], ee_prefix
+    )
+    unchanged = set()
+    for asset, local in candidates:
+        if update_times[asset] == previous[asset][1]:
+            # the listing does not say what the asset holds, which the rules
+            # reading it need for early cutoff
+            utils.write_update_time(
+                asset, local, None if early_cutoff else update_times[asset]
+            )
+            print(f'{asset} is unchanged, skipping its task')
+            unchanged.add(asset)
+    return [x for x in created if x[0] not in unchanged]
+
+
+def cached_asset(asset):
+    return f'{cache_prefix}/{fingerprints[asset]}'
+
+
+def copy_from_cache(created):
+    """ Copies the outputs found in the shared cache folder and returns the
+    tasks of the other outputs.
+    """
+    cached = utils.get_update_times(
+        [cached_asset(asset) for asset, _, _ in created
+         if asset not in resumed],
+        cache_prefix + '/',
+    )
+    remaining = []
+    for item in created:
+        asset, local, _ = item
+        if cached.get(cached_asset(asset)) is None:
+            remaining.append(item)
+            continue
+        print(f'Copying {asset} from {cached_asset(asset)}')
+        client.call('copyAsset', cached_asset(asset), asset, True,
+                    target=asset)
+        update_time = utils.write_update_time(asset, local)
+        cache.put_fingerprint(asset, fingerprints[asset], update_time)
+    return remaining
 
-# load the create_tasks function from the given file
-# adapted from:
-# https://docs.python.org/3/library/importlib.html#importing-a-source-file-directly
-spec = importlib.util.spec_from_file_location("geemake_rule", script)
-module = importlib.util.module_from_spec(spec)
-spec.loader.exec_module(module)
 
-for asset, task in module.create_tasks(inputs, outputs):
-    local_file = asset.replace(ee_prefix, local_prefix)
+def publish(asset):
+    """ Copies a freshly created output into the shared cache folder. """
     try:
-        ee.data.deleteAsset(asset)
-        os.remove(local_file)
-    except (ee.EEException, FileNotFoundError):
-        pass
-    p = Process(target=poll, args=(asset, local_file, task))
-    p.start()
+        client.call('copyAsset', asset, cached_asset(asset), True,
+                    target=cached_asset(asset))
+    except ee.EEException as e:
+        print(f'Could not publish {asset} to {cache_prefix}: {e}')
+
+
+def cleanup(created):
+    """ Deletes the existing outputs of a batch of tasks, and their local
+    files, before any of them is started.
+    """
+    stale = [x for x in created if x[0] not in resumed]
+    deleted = utils.delete_assets((x[0] for x in stale), max_workers)
+    cache.put_many({asset: None for asset, _, _ in stale})
+    for _, local, _ in stale:
+        try:
+            os.remove(local)
+        except FileNotFoundError:
+            pass
+    for asset in deleted:
+        print(f'Deleted {asset}')
+    if deleted:
+        print(f'Deleted {len(deleted)} existing assets before exporting')
+
+
+def reattach(created):
+    """ Finds the tasks of an interrupted run that still create the same
+    outputs so that start resumes them, tasks whose fingerprint changed are
+    cancelled.
+    """
+    submitted = cache.get_submitted(asset for asset, _, _ in created)
+    if not submitted:
+        return
+    states = tasks.get_task_states(x[0] for x in submitted.values())
+    for asset, _, _ in created:
+        task_id, fingerprint, started = submitted.get(asset, (None,) * 3)
+        state = states.get(task_id)
+        if fingerprint == fingerprints[asset] and \
+                state in (*tasks.ACTIVE_STATES, 'COMPLETED'):
+            # the task is already running, it holds a slot even if none
+            # is free
+            tickets[asset] = quota.hold(priority)
+            resumed[asset] = task_id
+            started_at[task_id] = started
+        elif state in tasks.ACTIVE_STATES:
+            print(f'Cancelling task {task_id}, its definition has changed')
+            client.call('cancelTask', task_id, target=task_id)
+
+
+def read_recipes(files):
+    """ Returns the recipes of the intermediates among files that were not
+    exported, along with the recipes those depend on.
+    """
+    recipes = {}
+    for local in files:
+        if not (local.startswith(local_prefix) and os.path.isfile(local)):
+            continue
+        recipe = utils.read_recipe(local)
+        if recipe is not None:
+            recipes.update(recipe['fused'])
+            recipes[local] = {k: v for k, v in recipe.items() if k != 'fused'}
+    return recipes
+
+
+def rule_files(files, names=(), recipes=None, cls=InputFiles):
+    """ Returns the ee assets that files track, as passed to create_tasks.
+
+    Intermediates that were not exported are replaced by the computation that
+    creates them.
+    """
+    def resolve(local):
+        if recipes and local in recipes:
+            return fused_expression(local, recipes)
+        return swap_prefix(local)
+    resolved = cls(toclone=files, custom_map=resolve)
+    resolved._take_names(names)
+    return resolved
+
+
+def fused_expression(local, recipes):
+    """ Returns the computation of an intermediate that was not exported. """
+    if local not in expressions:
+        recipe = recipes[local]
+        create_tasks = utils.load_create_tasks(recipe['script'])
+        created = create_tasks(
+            rule_files(recipe['input'], recipe['input_names'], recipes),
+            rule_files(recipe['output'], recipe['output_names'],
+                       cls=OutputFiles),
+        )
+        for asset, task in created:
+            expressions[asset.replace(ee_prefix, local_prefix)] = \
+                task.config['expression']
+    return expressions[local]
+
+
+def file_names(files):
+    return list(getattr(files, '_get_names', lambda: ())())
+
+
+# computations of the intermediates that were not exported by local file
+expressions = {}
+
+# the rule scripts build earth engine objects so the session must be ready
+session.initialize()
+
+recipes = read_recipes(snakemake.input)
+inputs = rule_files(snakemake.input, recipes=recipes)
+outputs = OutputFiles(toclone=snakemake.output, custom_map=swap_prefix)
+
+# create_tasks may be a generator, it is consumed a batch at a time as
+# earlier tasks finish so that only a window of tasks is held at once
+local_files = {swap_prefix(x): x for x in snakemake.output}
+created = (
+    (asset, local_files.get(asset, asset.replace(ee_prefix, local_prefix)),
+     task)
+    for asset, task in utils.load_create_tasks(script)(inputs, outputs)
+)
+
+# inputs created by the workflow are identified by the fingerprint of the
+# task that created them, so that fingerprints do not depend on when or
+# under which prefix the workflow ran. With early cutoff inputs are
+# identified by their content where it is known, so that an input rebuilt
+# with the same data leaves the fingerprints of this rule's tasks unchanged
+upstream = {}
+for local in snakemake.input:
+    if local in recipes:
+        upstream.update(recipes[local]['upstream'])
+    elif (local.startswith(local_prefix) or utils.storage_asset(local)) \
+            and os.path.isfile(local):
+        asset, update_time = utils.read_update_time(local)
+        content = utils.read_content(local) if early_cutoff else None
+        upstream[asset] = update_time if content is None else content
+for asset, (fingerprint, update_time) in \
+        cache.get_fingerprints(upstream).items():
+    if upstream[asset] == update_time:
+        upstream[asset] = fingerprint
+
+# temporary outputs only read by other earth engine rules are not exported,
+# the rules that read them compose this rule's computation into their own
+fused = utils.read_fused()
+recipe = {
+    'script': script,
+    'input': list(snakemake.input),
+    'input_names': file_names(snakemake.input),
+    'output': list(snakemake.output),
+    'output_names': file_names(snakemake.output),
+    'upstream': upstream,
+    'fused': recipes,
+}
+
+
+def prepare(created):
+    """ Decides how to create each output of a batch and returns the tasks
+    that must be started (or resumed).
+    """
+    for asset, local, task in created:
+        fingerprints[asset] = utils.task_fingerprint(task, upstream, ee_prefix)
+        if local in fused:
+            print(f'Not exporting {asset}, it is computed by the rules using '
+                  f'it')
+            utils.write_recipe(asset, local, recipe)
+    created = [x for x in created if x[1] not in fused]
+    if skip_unchanged:
+        created = skip_unchanged_tasks(created)
+    # tasks left running by an interrupted run are polled, not restarted
+    reattach(created)
+    if cache_prefix:
+        created = copy_from_cache(created)
+    cleanup(created)
+    runtimes = cache.get_runtimes(asset for asset, _, _ in created)
+    expected.update({x: runtimes[x[0]] for x in created if x[0] in runtimes})
+    return created
+
+
+def queued(created, size):
+    while True:
+        batch = list(itertools.islice(created, size))
+        if not batch:
+            return
+        yield from prepare(batch)
+
+
+# a single loop starts and polls every task rather than one process per
+# task, checks back off while tasks run and are timed by how long they took
+# last time
+tasks.monitor({}, wait, finish, max_wait, expected,
+              queued(created, window or tasks.DEFAULT_WINDOW), start,
+              started_at, window, statuses)
+if progress['started']:
+    report()
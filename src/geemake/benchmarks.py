@@ -0,0 +1,153 @@
+""" Records what each earth engine task of a rule cost.
+
+Snakemake's benchmark: directive only measures the wrapper process, which
+spends its time waiting. Unless the config key ee_benchmark is false, the
+wrapper appends a row for every task that finishes to
+.snakemake/geemake/benchmarks/<rule>.tsv, and to the file given by the
+rule's params.ee_benchmark if there is one, with:
+
+    time: when the task finished, in epoch time.
+    run: the id of the run, see geemake.client.
+    rule, asset, task_id, state: the task and what it created.
+    eecu_seconds: the EECU-seconds earth engine billed for the task.
+    queue_wait: seconds from the task being submitted to it starting.
+    run_time: seconds from the task starting to it finishing.
+    wall_time: seconds from the wrapper submitting (or resuming) the task
+        to seeing it finish.
+    size_bytes: the size of the asset created.
+
+Values earth engine does not report are left empty. The files are
+tab-separated with a header, e.g. pandas.read_csv(path, sep='\t').
+"""
+import csv
+import fcntl
+import os
+import time
+
+from geemake import client
+
+BENCHMARK_DIR = os.path.join('.snakemake', 'geemake', 'benchmarks')
+
+FIELDS = (
+    'time', 'run', 'rule', 'asset', 'task_id', 'state', 'eecu_seconds',
+    'queue_wait', 'run_time', 'wall_time', 'size_bytes',
+)
+
+_settings = {'enabled': True}
+
+
+def configure(config):
+    """ Sets the benchmark options from a snakemake config.
+
+    Args:
+        config: dictionary of snakemake configuration parameters, the key
+            ee_benchmark (default true) is used.
+
+    Returns:
+        None
+    """
+    _settings['enabled'] = bool(config.get('ee_benchmark', True))
+
+
+def _seconds(status, end, start):
+    if status.get(end) is None or status.get(start) is None:
+        return None
+    return max(status[end] - status[start], 0) / 1000
+
+
+def task_metrics(status):
+    """ Returns what a finished task cost from its status.
+
+    Args:
+        status: dict, the task as returned by ee.data.getTaskList or
+            ee.data.getTaskStatus.
+
+    Returns:
+        dict: eecu_seconds, queue_wait and run_time, None where the status
+        does not say.
+    """
+    return {
+        'eecu_seconds': status.get('batch_eecu_usage_seconds'),
+        'queue_wait': _seconds(
+            status, 'start_timestamp_ms', 'creation_timestamp_ms'
+        ),
+        'run_time': _seconds(
+            status, 'update_timestamp_ms', 'start_timestamp_ms'
+        ),
+    }
+
+
+def path(rule):
+    """ Returns the file that the tasks of rule are recorded in. """
+    return os.path.join(BENCHMARK_DIR, f'{rule}.tsv')
+
+
+def _append(file, row):
+    directory = os.path.dirname(file)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(file, 'a', newline='') as f:
+        # the wrappers of a rule append to the same file, the lock makes
+        # sure that only the first of them writes the header
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            writer = csv.DictWriter(f, fieldnames=FIELDS, delimiter='\t')
+            if os.fstat(f.fileno()).st_size == 0:
+                writer.writeheader()
+            writer.writerow(row)
+            f.flush()
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def record(rule, asset, status, wall_time, size_bytes=None, extra=None):
+    """ Appends a row for a finished task to the benchmark files.
+
+    Args:
+        rule: str, the name of the rule that ran the task.
+        asset: str, path to the ee asset the task created.
+        status: dict, the final status of the task, see task_metrics.
+        wall_time: float, seconds the wrapper waited for the task.
+        size_bytes: int, the size of the asset created.
+        extra: str, another file to append the row to, e.g. the rule's
+            params.ee_benchmark.
+
+    Returns:
+        dict: the row, None if benchmarks are disabled.
+    """
+    if not _settings['enabled']:
+        return None
+    row = {
+        'time': time.time(),
+        'run': client.run_id(),
+        'rule': rule,
+        'asset': asset,
+        'task_id': status.get('id'),
+        'state': status.get('state'),
+        **task_metrics(status),
+        'wall_time': wall_time,
+        'size_bytes': size_bytes,
+    }
+    for file in (path(rule), extra):
+        if file:
+            _append(file, row)
+    return row
+
+
+def read(file):
+    """ Returns the rows recorded in a benchmark file.
+
+    Args:
+        file: str, e.g. path(rule).
+
+    Returns:
+        list of dict: the rows, with numbers as floats and missing values as
+        None.
+    """
+    with open(file, newline='') as f:
+        rows = list(csv.DictReader(f, delimiter='\t'))
+    for row in rows:
+        for k in FIELDS[6:]:
+            row[k] = float(row[k]) if row[k] else None
+        row['time'] = float(row['time'])
+    return rows
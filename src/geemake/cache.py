@@ -0,0 +1,366 @@
+""" On-disk cache of Earth Engine asset metadata.
+
+The cache is a small SQLite database under .snakemake/geemake/ so that it is
+shared by initialize, every wrapper process and anything else run from the
+same working directory. Reads only return entries younger than the configured
+ttl, writes always go through so the cache stays current even while reads are
+disabled.
+"""
+import json
+import os
+import sqlite3
+import time
+
+CACHE_DIR = os.path.join('.snakemake', 'geemake')
+CACHE_FILE = 'metadata.sqlite'
+
+# reads are disabled until configure is called with a positive ttl
+_settings = {
+    'path': os.path.join(CACHE_DIR, CACHE_FILE),
+    'ttl': 0,
+    'refresh': False,
+}
+
+
+def configure(config):
+    """ Sets the cache options from a snakemake config.
+
+    Args:
+        config: dictionary of snakemake configuration parameters, the keys
+            ee_cache_ttl (seconds an entry stays valid, 0 disables reads) and
+            ee_refresh (if true, ignore every existing entry) are used.
+
+    Returns:
+        None
+    """
+    _settings['ttl'] = float(config.get('ee_cache_ttl', 0))
+    _settings['refresh'] = bool(config.get('ee_refresh', False))
+
+
+def _connect(create=False):
+    path = _settings['path']
+    if not create and not os.path.isfile(path):
+        return None
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    connection = sqlite3.connect(path, timeout=30)
+    connection.execute(
+        'CREATE TABLE IF NOT EXISTS assets ('
+        'asset TEXT PRIMARY KEY, update_time REAL, fetched REAL)'
+    )
+    connection.execute(
+        'CREATE TABLE IF NOT EXISTS runtimes ('
+        'asset TEXT PRIMARY KEY, runtime REAL)'
+    )
+    connection.execute(
+        'CREATE TABLE IF NOT EXISTS fingerprints ('
+        'asset TEXT PRIMARY KEY, fingerprint TEXT, update_time REAL)'
+    )
+    connection.execute(
+        'CREATE TABLE IF NOT EXISTS submitted ('
+        'asset TEXT PRIMARY KEY, task_id TEXT, fingerprint TEXT, '
+        'started REAL)'
+    )
+    connection.execute(
+        'CREATE TABLE IF NOT EXISTS contents ('
+        'asset TEXT PRIMARY KEY, update_time REAL, content TEXT)'
+    )
+    return connection
+
+
+# most keys in a single query, to stay under sqlite's limit on the number of
+# query parameters
+MAX_KEYS = 500
+
+
+def _select_in(sql, keys, params=()):
+    """ Returns the rows of a query for many keys, a chunk of keys at a time.
+
+    Args:
+        sql: str, the query, with {} where the placeholders of the keys go,
+            e.g. 'SELECT asset, runtime FROM runtimes WHERE asset IN ({})'.
+        keys: iterable of the values to look up.
+        params: sequence, the values of the placeholders before the keys.
+
+    Returns:
+        list of tuples: the rows of every chunk, empty if there is no cache.
+    """
+    keys = list(keys)
+    if not keys:
+        return []
+    connection = _connect()
+    if connection is None:
+        return []
+    rows = []
+    with connection:
+        for i in range(0, len(keys), MAX_KEYS):
+            chunk = keys[i:i + MAX_KEYS]
+            rows.extend(connection.execute(
+                sql.format(','.join('?' * len(chunk))), [*params, *chunk]
+            ))
+    connection.close()
+    return rows
+
+
+def enabled():
+    """ Returns True if cached entries may currently be read. """
+    return _settings['ttl'] > 0 and not _settings['refresh']
+
+
+def get_many(assets):
+    """ Returns the cached update times of the given assets.
+
+    Args:
+        assets: iterable of strings, paths to earth engine assets.
+
+    Returns:
+        dict: mapping each asset with a valid cache entry to its update time
+        in epoch time, assets without a valid entry are left out.
+    """
+    if not enabled():
+        return {}
+    oldest = time.time() - _settings['ttl']
+    return dict(_select_in(
+        'SELECT asset, update_time FROM assets WHERE fetched >= ? '
+        'AND asset IN ({})',
+        assets, [oldest],
+    ))
+
+
+def get(asset):
+    """ Returns the cached update time of asset or None if it is not cached.
+
+    Args:
+        asset: string, path to an earth engine asset.
+
+    Returns:
+        float or None: the update time of the asset in epoch time.
+    """
+    return get_many([asset]).get(asset)
+
+
+def put_many(update_times):
+    """ Stores the update times of many assets in the cache.
+
+    Args:
+        update_times: dict mapping paths to earth engine assets to their
+            update time in epoch time, assets mapped to None are removed.
+
+    Returns:
+        None
+    """
+    if not update_times:
+        return
+    now = time.time()
+    connection = _connect(create=True)
+    with connection:
+        connection.executemany(
+            'INSERT OR REPLACE INTO assets VALUES (?, ?, ?)',
+            [(k, v, now) for k, v in update_times.items() if v is not None],
+        )
+        connection.executemany(
+            'DELETE FROM assets WHERE asset = ?',
+            [(k,) for k, v in update_times.items() if v is None],
+        )
+    connection.close()
+
+
+def put(asset, update_time):
+    """ Stores the update time of asset in the cache.
+
+    Args:
+        asset: string, path to an earth engine asset.
+        update_time: float, the update time of the asset in epoch time, or
+            None to remove the asset from the cache.
+
+    Returns:
+        None
+    """
+    put_many({asset: update_time})
+
+
+def remove(asset):
+    """ Removes asset from the cache, e.g. after it has been deleted.
+
+    Args:
+        asset: string, path to an earth engine asset.
+
+    Returns:
+        None
+    """
+    if os.path.isfile(_settings['path']):
+        put(asset, None)
+
+
+def get_runtimes(assets):
+    """ Returns how long the tasks that last created the given assets took.
+
+    Runtimes are kept regardless of the ttl, they are only used to predict
+    when a new task creating the same asset will finish.
+
+    Args:
+        assets: iterable of strings, paths to earth engine assets.
+
+    Returns:
+        dict: mapping each asset with a recorded runtime to that runtime in
+        seconds.
+    """
+    return dict(_select_in(
+        'SELECT asset, runtime FROM runtimes WHERE asset IN ({})', assets
+    ))
+
+
+def put_runtime(asset, runtime):
+    """ Records how long the task that created asset took.
+
+    Args:
+        asset: string, path to an earth engine asset.
+        runtime: float, the runtime of the task in seconds.
+
+    Returns:
+        None
+    """
+    connection = _connect(create=True)
+    with connection:
+        connection.execute(
+            'INSERT OR REPLACE INTO runtimes VALUES (?, ?)',
+            (asset, runtime),
+        )
+    connection.close()
+
+
+def get_fingerprints(assets):
+    """ Returns the fingerprints of the tasks that last created the assets.
+
+    Like runtimes, fingerprints are kept regardless of the ttl.
+
+    Args:
+        assets: iterable of strings, paths to earth engine assets.
+
+    Returns:
+        dict: mapping each asset with a recorded fingerprint to a tuple of
+        the fingerprint and the update time the task gave the asset.
+    """
+    rows = _select_in(
+        'SELECT asset, fingerprint, update_time FROM fingerprints '
+        'WHERE asset IN ({})',
+        assets,
+    )
+    return {x: (f, t) for x, f, t in rows}
+
+
+def put_fingerprint(asset, fingerprint, update_time):
+    """ Records the fingerprint of the task that created asset.
+
+    Args:
+        asset: string, path to an earth engine asset.
+        fingerprint: string, as returned by utils.task_fingerprint.
+        update_time: float, the update time of the asset in epoch time once
+            the task finished.
+
+    Returns:
+        None
+    """
+    connection = _connect(create=True)
+    with connection:
+        connection.execute(
+            'INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?)',
+            (asset, fingerprint, update_time),
+        )
+    connection.close()
+
+
+def get_contents(assets):
+    """ Returns the recorded contents of the assets, see utils.content_of.
+
+    Like fingerprints, contents are kept regardless of the ttl.
+
+    Args:
+        assets: iterable of strings, paths to earth engine assets.
+
+    Returns:
+        dict: mapping each asset with a recorded content to a tuple of the
+        update time of the asset when it was recorded and the content.
+    """
+    rows = _select_in(
+        'SELECT asset, update_time, content FROM contents '
+        'WHERE asset IN ({})',
+        assets,
+    )
+    return {x: (t, json.loads(c)) for x, t, c in rows}
+
+
+def put_content(asset, update_time, content):
+    """ Records the content of asset.
+
+    Args:
+        asset: string, path to an earth engine asset.
+        update_time: float, the update time of the asset in epoch time.
+        content: dict, as returned by utils.content_of.
+
+    Returns:
+        None
+    """
+    connection = _connect(create=True)
+    with connection:
+        connection.execute(
+            'INSERT OR REPLACE INTO contents VALUES (?, ?, ?)',
+            (asset, update_time, json.dumps(content, sort_keys=True)),
+        )
+    connection.close()
+
+
+def get_submitted(assets):
+    """ Returns the tasks submitted to create the assets that have not been
+    seen to finish, e.g. because the run that started them was interrupted.
+
+    Args:
+        assets: iterable of strings, paths to earth engine assets.
+
+    Returns:
+        dict: mapping each asset with a recorded task to a tuple of the task
+        id, the fingerprint of the task and the epoch time it was started.
+    """
+    rows = _select_in(
+        'SELECT asset, task_id, fingerprint, started FROM submitted '
+        'WHERE asset IN ({})',
+        assets,
+    )
+    return {x[0]: x[1:] for x in rows}
+
+
+def put_submitted(asset, task_id, fingerprint, started):
+    """ Records a task submitted to create asset until it finishes.
+
+    Args:
+        asset: string, path to an earth engine asset.
+        task_id: string, the id of the task.
+        fingerprint: string, as returned by utils.task_fingerprint.
+        started: float, the epoch time the task was started.
+
+    Returns:
+        None
+    """
+    connection = _connect(create=True)
+    with connection:
+        connection.execute(
+            'INSERT OR REPLACE INTO submitted VALUES (?, ?, ?, ?)',
+            (asset, task_id, fingerprint, started),
+        )
+    connection.close()
+
+
+def remove_submitted(asset):
+    """ Forgets the task submitted to create asset once it has finished.
+
+    Args:
+        asset: string, path to an earth engine asset.
+
+    Returns:
+        None
+    """
+    connection = _connect()
+    if connection is None:
+        return
+    with connection:
+        connection.execute('DELETE FROM submitted WHERE asset = ?', (asset,))
+    connection.close()
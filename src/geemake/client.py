@@ -0,0 +1,407 @@
+""" The single entry point for every request geemake makes to Earth Engine.
+
+Requests are paced by the workflow wide rate limit (see geemake.ratelimit)
+and requests that fail with a transient error (e.g. 429 or 503) are retried
+with exponential backoff, up to ee_max_retries times (default 5) starting
+ee_retry_wait seconds apart (default 1). Errors that retrying cannot fix,
+such as a missing asset, are raised right away.
+
+Each request is timed and recorded with the operation, the asset or task it
+targets, how many times it was retried and the rule that made it. When the
+config key ee_trace is true the records of a whole run, from initialize and
+from every wrapper, are appended to .snakemake/geemake/traces/<run>.jsonl
+and a summary table is printed when snakemake exits, alongside a CSV copy of
+the trace (and a Prometheus text file if ee_trace_prometheus is true).
+
+Hooks, callables that receive every record as it is made, can be added with
+add_hook, e.g. opentelemetry_hook to export each request as a span.
+"""
+import atexit
+import csv
+import json
+import os
+import random
+import re
+import socket
+import sys
+import threading
+import time
+from collections import defaultdict
+
+import ee
+
+from geemake import ratelimit, session
+
+TRACE_DIR = os.path.join('.snakemake', 'geemake', 'traces')
+RUN_ID_VAR = 'GEEMAKE_RUN_ID'
+
+# records are written to the trace in batches of this size
+FLUSH_EVERY = 100
+
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_RETRY_WAIT = 1.0
+# longest time to wait before retrying a request, in seconds
+MAX_RETRY_WAIT = 60
+
+# http statuses of errors that may go away if the request is made again
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+_RETRYABLE_STATUS = re.compile(
+    r'\b(' + '|'.join(str(x) for x in RETRYABLE_STATUSES) + r')\b'
+)
+_RETRYABLE_MESSAGES = (
+    'too many requests', 'quota exceeded', 'rate limit',
+    'service unavailable', 'internal error', 'backend error',
+    'deadline exceeded', 'timed out', 'temporarily unavailable',
+    'connection reset', 'connection aborted',
+)
+
+FIELDS = (
+    'time', 'run', 'pid', 'rule', 'operation', 'target', 'latency',
+    'retries', 'error',
+)
+
+_lock = threading.Lock()
+# the rule of the job run by the current thread, see geemake.daemon
+_local = threading.local()
+_settings = {
+    'trace': False,
+    'prometheus': False,
+    'rule': None,
+    'hooks': [],
+    'records': [],
+    'registered': False,
+    'opentelemetry': False,
+    'max_retries': DEFAULT_MAX_RETRIES,
+    'retry_wait': DEFAULT_RETRY_WAIT,
+}
+
+
+def configure(config, rule=None):
+    """ Sets the retry, rate limit and tracing options from a snakemake
+    config.
+
+    Args:
+        config: dictionary of snakemake configuration parameters, the keys
+            ee_max_retries, ee_retry_wait, ee_trace, ee_trace_prometheus and
+            ee_trace_opentelemetry are used, as well as the keys read by
+            geemake.ratelimit.
+        rule: str, the name of the rule that is making the requests.
+
+    Returns:
+        None
+    """
+    _settings['max_retries'] = int(
+        config.get('ee_max_retries', DEFAULT_MAX_RETRIES)
+    )
+    _settings['retry_wait'] = float(
+        config.get('ee_retry_wait', DEFAULT_RETRY_WAIT)
+    )
+    ratelimit.configure(config)
+    _settings['trace'] = bool(config.get('ee_trace', False))
+    _settings['prometheus'] = bool(config.get('ee_trace_prometheus', False))
+    _settings['rule'] = rule
+    _local.rule = rule
+    if config.get('ee_trace_opentelemetry') and \
+            not _settings['opentelemetry']:
+        add_hook(opentelemetry_hook())
+        _settings['opentelemetry'] = True
+    if _settings['trace'] and not _settings['registered']:
+        atexit.register(flush)
+        _settings['registered'] = True
+
+
+def run_id():
+    """ Returns the id of the current run, shared with child processes. """
+    if RUN_ID_VAR not in os.environ:
+        timestamp = time.strftime('%Y%m%dT%H%M%S')
+        os.environ[RUN_ID_VAR] = f'{timestamp}-{os.getpid()}'
+    return os.environ[RUN_ID_VAR]
+
+
+def start_run():
+    """ Starts a new traced run, called once per snakemake invocation.
+
+    Child processes (the wrappers) inherit the run id so that their requests
+    are added to the same trace. A summary is reported at exit.
+
+    Returns:
+        None
+    """
+    os.environ.pop(RUN_ID_VAR, None)
+    run_id()
+    if _settings['trace']:
+        atexit.register(report)
+
+
+def add_hook(hook):
+    """ Registers hook to be called with every record as it is made.
+
+    Args:
+        hook: callable taking one dictionary with the keys in FIELDS.
+
+    Returns:
+        None
+    """
+    with _lock:
+        _settings['hooks'].append(hook)
+
+
+def trace_path(run=None, extension='jsonl'):
+    """ Returns the path of the trace of a run. """
+    return os.path.join(TRACE_DIR, f'{run or run_id()}.{extension}')
+
+
+def is_retryable(error):
+    """ Returns True if a request that failed with error may succeed if it is
+    made again, e.g. because of rate limiting or a server error.
+    """
+    if isinstance(error, (ConnectionError, TimeoutError, socket.timeout)):
+        return True
+    status = getattr(getattr(error, 'resp', None), 'status', None)
+    if status is not None:
+        return int(status) in RETRYABLE_STATUSES
+    if not isinstance(error, ee.EEException):
+        return False
+    message = str(error).lower()
+    if 'does not exist' in message or 'not found' in message:
+        return False
+    return bool(_RETRYABLE_STATUS.search(message)) or \
+        any(x in message for x in _RETRYABLE_MESSAGES)
+
+
+def retry_delay(retries):
+    """ Returns how long to wait before making a request again.
+
+    Args:
+        retries: int, the number of times the request has been retried.
+
+    Returns:
+        float: the number of seconds to wait.
+    """
+    delay = min(MAX_RETRY_WAIT, _settings['retry_wait'] * 2 ** retries)
+    return delay * random.uniform(0.5, 1)
+
+
+def _record(operation, target, func, *args, **kwargs):
+    record = {
+        'time': time.time(),
+        'run': run_id(),
+        'pid': os.getpid(),
+        'rule': getattr(_local, 'rule', _settings['rule']),
+        'operation': operation,
+        'target': target,
+        'retries': 0,
+        'error': None,
+    }
+    start = time.perf_counter()
+    try:
+        while True:
+            ratelimit.acquire()
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                if record['retries'] >= _settings['max_retries'] or \
+                        not is_retryable(e):
+                    raise
+            time.sleep(retry_delay(record['retries']))
+            record['retries'] += 1
+    except Exception as e:
+        record['error'] = type(e).__name__
+        raise
+    finally:
+        record['latency'] = time.perf_counter() - start
+        for hook in list(_settings['hooks']):
+            hook(record)
+        if _settings['trace']:
+            with _lock:
+                _settings['records'].append(record)
+                full = len(_settings['records']) >= FLUSH_EVERY
+            if full:
+                flush()
+
+
+def call(operation, *args, target=None, **kwargs):
+    """ Calls ee.data.<operation>, retrying transient errors, and records
+    the request.
+
+    Earth Engine is initialized first if needed.
+
+    Args:
+        operation: str, the name of a function in ee.data, e.g. getAsset.
+        *args: passed on to the function.
+        target: str, the asset or task that the request is about.
+        **kwargs: passed on to the function.
+
+    Returns:
+        the result of the function.
+    """
+    session.initialize()
+    return _record(operation, target, getattr(ee.data, operation), *args,
+                   **kwargs)
+
+
+def start_task(task, target=None):
+    """ Starts an ee.batch.Task and records the request.
+
+    Args:
+        task: ee.batch.Task, the task to start.
+        target: str, the asset the task creates.
+
+    Returns:
+        None
+    """
+    session.initialize()
+    _record('startTask', target, task.start)
+
+
+def flush():
+    """ Appends the records made by this process to the trace of the run.
+    """
+    with _lock:
+        records, _settings['records'] = _settings['records'], []
+    if not records:
+        return
+    os.makedirs(TRACE_DIR, exist_ok=True)
+    with open(trace_path(), 'a') as f:
+        f.write(''.join(json.dumps(x) + '\n' for x in records))
+
+
+def read_trace(run=None):
+    """ Returns the records of every request made during a run.
+
+    Args:
+        run: str, the id of the run, defaults to the current run.
+
+    Returns:
+        list of dict: one record per request.
+    """
+    try:
+        with open(trace_path(run)) as f:
+            return [json.loads(x) for x in f if x.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def summarize(records, key='operation'):
+    """ Aggregates records by key.
+
+    Args:
+        records: list of dict, as returned by read_trace.
+        key: str, the field to group by, e.g. operation or rule.
+
+    Returns:
+        dict: mapping each value of key to a dict of calls, errors,
+        retries, total (seconds) and max (seconds).
+    """
+    summary = defaultdict(lambda: {
+        'calls': 0, 'errors': 0, 'retries': 0, 'total': 0.0, 'max': 0.0,
+    })
+    for record in records:
+        row = summary[record.get(key) or '-']
+        row['calls'] += 1
+        row['errors'] += record['error'] is not None
+        row['retries'] += record['retries']
+        row['total'] += record['latency']
+        row['max'] = max(row['max'], record['latency'])
+    return dict(summary)
+
+
+def format_summary(records):
+    """ Returns a plain text table summarizing records by operation and rule.
+    """
+    lines = []
+    for key in ('operation', 'rule'):
+        lines.append(
+            f'{key:<24} {"calls":>7} {"errors":>7} {"retries":>7} '
+            f'{"total (s)":>10} {"mean (ms)":>10} {"max (ms)":>10}'
+        )
+        summary = summarize(records, key).items()
+        for name, row in sorted(summary, key=lambda x: -x[1]['total']):
+            lines.append(
+                f'{name:<24} {row["calls"]:>7} {row["errors"]:>7} '
+                f'{row["retries"]:>7} {row["total"]:>10.3f} '
+                f'{1000 * row["total"] / row["calls"]:>10.1f} '
+                f'{1000 * row["max"]:>10.1f}'
+            )
+        lines.append('')
+    return '\n'.join(lines)
+
+
+def prometheus_text(records):
+    """ Returns records aggregated in the Prometheus text exposition format.
+    """
+    metrics = (
+        ('calls', 'geemake_ee_requests_total', 'counter',
+         'Number of requests made to Earth Engine.'),
+        ('errors', 'geemake_ee_request_errors_total', 'counter',
+         'Number of requests to Earth Engine that failed.'),
+        ('retries', 'geemake_ee_request_retries_total', 'counter',
+         'Number of times requests to Earth Engine were retried.'),
+        ('total', 'geemake_ee_request_seconds_total', 'counter',
+         'Time spent waiting on requests to Earth Engine.'),
+    )
+    grouped = defaultdict(list)
+    for record in records:
+        grouped[(record['operation'], record.get('rule') or '')].append(
+            record
+        )
+    lines = []
+    for field, name, kind, description in metrics:
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {kind}')
+        for (operation, rule), group in sorted(grouped.items()):
+            value = summarize(group)[operation][field]
+            lines.append(
+                f'{name}{{operation="{operation}",rule="{rule}"}} {value}'
+            )
+    return '\n'.join(lines) + '\n'
+
+
+def opentelemetry_hook(tracer_name='geemake'):
+    """ Returns a hook that exports every request as an OpenTelemetry span.
+
+    Requires the opentelemetry-api package, the spans go to whichever tracer
+    provider the application has configured.
+    """
+    try:
+        from opentelemetry import trace
+    except ImportError as e:
+        raise ImportError(
+            'ee_trace_opentelemetry requires the opentelemetry-api package'
+        ) from e
+    tracer = trace.get_tracer(tracer_name)
+
+    def hook(record):
+        end = int(record['time'] * 1e9 + record['latency'] * 1e9)
+        span = tracer.start_span(
+            f'ee.{record["operation"]}',
+            start_time=int(record['time'] * 1e9),
+            attributes={
+                k: v for k, v in record.items()
+                if v is not None and k not in ('time', 'latency')
+            },
+        )
+        span.end(end_time=end)
+    return hook
+
+
+def report():
+    """ Prints a summary of the current run and writes the trace as CSV.
+
+    Returns:
+        None
+    """
+    flush()
+    records = read_trace()
+    if not records:
+        return
+    with open(trace_path(extension='csv'), 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS)
+        writer.writeheader()
+        writer.writerows(records)
+    if _settings['prometheus']:
+        with open(trace_path(extension='prom'), 'w') as f:
+            f.write(prometheus_text(records))
+    print(f'Earth Engine requests made during run {run_id()} '
+          f'(trace in {trace_path()}):', file=sys.stderr)
+    print(format_summary(records), file=sys.stderr)
@@ -0,0 +1,372 @@
+""" A long lived process that runs the jobs of earth engine rules.
+
+Every earth engine job normally runs wrapper.py in a new python process that
+imports snakemake and ee before it can do anything else. When the config key
+ee_daemon is true, initialize starts a daemon that pays for this once: each
+wrapper hands its job to the daemon over a Unix socket under
+.snakemake/geemake/ and waits for it to finish. The daemon reads each job
+itself and, before forking the process that runs it, initializes the earth
+engine session and compiles the job's wrapper and rule script, so that the
+forked process finds them ready. Jobs run concurrently, in their own
+processes, without sharing the settings of the geemake modules or the
+environment. The daemon exits once it has been idle for ee_daemon_idle
+seconds (default 600).
+
+Jobs are sent over the socket, which only its owner may connect to, as JSON
+holding the files, params and config of the job. If the daemon cannot be
+reached, or the job cannot be written as JSON, the wrapper runs the job
+itself. This module does not import ee so that handing a job over stays
+cheap.
+"""
+import argparse
+import io
+import json
+import os
+import socket
+import socketserver
+import struct
+import subprocess
+import sys
+import time
+import traceback
+
+SOCKET_FILE = os.path.join('.snakemake', 'geemake', 'daemon.sock')
+LOG_FILE = os.path.join('.snakemake', 'geemake', 'daemon.log')
+DEFAULT_IDLE = 600
+
+# longest time in seconds that start waits for a new daemon to listen
+STARTUP_WAIT = 10
+
+# longest time in seconds that the daemon waits for a job to be sent once a
+# wrapper has connected
+RECEIVE_WAIT = 10
+
+# the parts of the snakemake object of a job that are sent to the daemon,
+# named lists and plain values
+NAMED_LISTS = ('input', 'output', 'params', 'wildcards', 'resources', 'log')
+VALUES = ('threads', 'config', 'rule', 'bench_iteration', 'scriptdir')
+
+_settings = {'serving': False}
+# compiled wrapper scripts by path
+_code = {}
+
+
+def serving():
+    """ Returns True if this process is the daemon. """
+    return _settings['serving']
+
+
+def _send(connection, data):
+    connection.sendall(struct.pack('>Q', len(data)) + data)
+
+
+def _receive(connection):
+    def read(size):
+        data = b''
+        while len(data) < size:
+            chunk = connection.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError('connection closed by the other side')
+            data += chunk
+        return data
+    size, = struct.unpack('>Q', read(8))
+    return read(size)
+
+
+def _connect():
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(SOCKET_FILE)
+    except OSError:
+        connection.close()
+        raise
+    return connection
+
+
+def running():
+    """ Returns True if a daemon is listening in the current directory. """
+    try:
+        _connect().close()
+    except OSError:
+        return False
+    return True
+
+
+def start(idle=DEFAULT_IDLE):
+    """ Starts a daemon in the current directory unless one is running.
+
+    The daemon outlives the calling process, its output goes to
+    .snakemake/geemake/daemon.log.
+
+    Args:
+        idle: float, seconds without a job after which the daemon exits.
+
+    Returns:
+        None
+    """
+    if running():
+        return
+    os.makedirs(os.path.dirname(LOG_FILE), exist_ok=True)
+    # the daemon runs the same copy of geemake as the caller
+    env = dict(os.environ)
+    package = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = os.pathsep.join(
+        x for x in (package, env.get('PYTHONPATH')) if x
+    )
+    with open(LOG_FILE, 'a') as log:
+        subprocess.Popen(
+            [sys.executable, '-m', 'geemake.daemon', '--idle', str(idle)],
+            stdin=subprocess.DEVNULL, stdout=log, stderr=log, env=env,
+            start_new_session=True,
+        )
+    deadline = time.time() + STARTUP_WAIT
+    while not running() and time.time() < deadline:
+        time.sleep(0.05)
+
+
+def encode(snakemake):
+    """ Returns the snakemake object of a job as JSON.
+
+    Args:
+        snakemake: the snakemake object of the job.
+
+    Returns:
+        str: the named lists (with their names) and values of the job.
+
+    Raises:
+        TypeError: if a part of the job, e.g. a param, is not JSON.
+    """
+    job = {}
+    for name in NAMED_LISTS:
+        items = getattr(snakemake, name, None)
+        items = [] if items is None else items
+        job[name] = {
+            'items': list(items),
+            'names': list(getattr(items, '_get_names', lambda: ())()),
+        }
+    for name in VALUES:
+        job[name] = getattr(snakemake, name, None)
+    return json.dumps(job)
+
+
+def decode(data):
+    """ Returns the snakemake object of a job written by encode. """
+    from snakemake import io
+    from snakemake.script import Snakemake
+
+    job = json.loads(data)
+
+    def named_list(key, cls):
+        items = cls(toclone=job[key]['items'])
+        items._take_names(
+            (name, tuple(index)) for name, index in job[key]['names']
+        )
+        return items
+    return Snakemake(
+        named_list('input', io.InputFiles),
+        named_list('output', io.OutputFiles),
+        named_list('params', io.Params),
+        named_list('wildcards', io.Wildcards),
+        job['threads'],
+        named_list('resources', io.Resources),
+        named_list('log', io.Log),
+        job['config'] or {},
+        job['rule'],
+        job['bench_iteration'],
+        job['scriptdir'],
+    )
+
+
+def submit(wrapper, snakemake):
+    """ Runs a job in the daemon and waits for it to finish.
+
+    Args:
+        wrapper: str, path to wrapper.py.
+        snakemake: the snakemake object of the job.
+
+    Returns:
+        bool: True if the daemon ran the job, False if it could not be
+        reached, the job cannot be sent as JSON or wrapper is not a local
+        file (e.g. a wrapper given by URL), and the job has not run.
+
+    Raises:
+        RuntimeError: if the job failed.
+    """
+    if not os.path.isfile(wrapper):
+        return False
+    try:
+        job = json.dumps({
+            'wrapper': wrapper,
+            'snakemake': encode(snakemake),
+            # e.g. the id of the run, see geemake.client
+            'environ': {
+                k: v for k, v in os.environ.items()
+                if k.startswith('GEEMAKE_')
+            },
+        })
+    except (TypeError, ValueError):
+        return False
+    try:
+        connection = _connect()
+    except OSError:
+        return False
+    with connection:
+        _send(connection, job.encode())
+        response = json.loads(_receive(connection))
+    sys.stdout.write(response['output'])
+    sys.stdout.flush()
+    if not response['ok']:
+        raise RuntimeError(
+            f'the job failed in the geemake daemon:\n{response["error"]}'
+        )
+    return True
+
+
+def _compile(wrapper):
+    modified = os.path.getmtime(wrapper)
+    if wrapper not in _code or _code[wrapper][0] != modified:
+        with open(wrapper) as f:
+            _code[wrapper] = (modified, compile(f.read(), wrapper, 'exec'))
+    return _code[wrapper][1]
+
+
+def run_job(wrapper, snakemake):
+    """ Runs wrapper.py for a job in this process.
+
+    Args:
+        wrapper: str, path to wrapper.py.
+        snakemake: the snakemake object of the job.
+
+    Returns:
+        None
+    """
+    exec(_compile(wrapper), {
+        '__name__': '__main__',
+        '__file__': wrapper,
+        'snakemake': snakemake,
+    })
+
+
+def prepare(job):
+    """ Does the work that every job would otherwise repeat, so that the
+    processes forked for jobs inherit it.
+
+    Initializes the earth engine session with the config of the job and
+    compiles its wrapper and rule script, which are compiled again only if
+    they change. Errors are left for the job to report.
+
+    Args:
+        job: dict, the job as sent by submit.
+
+    Returns:
+        None
+    """
+    from geemake import session, utils
+
+    try:
+        snakemake = json.loads(job['snakemake'])
+        session.configure(snakemake['config'] or {})
+        session.initialize()
+        _compile(job['wrapper'])
+        params = snakemake['params']
+        for name, (start, _) in params['names']:
+            if name == 'script':
+                utils.load_create_tasks(params['items'][start])
+    except Exception:
+        pass
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    """ Runs a job in the process forked for it. """
+
+    def handle(self):
+        from geemake import client
+
+        # read by the daemon before forking, see _Server.process_request
+        job = self.server.job
+        sys.stdout = sys.stderr = output = io.StringIO()
+        try:
+            os.environ.update(job['environ'])
+            run_job(job['wrapper'], decode(job['snakemake']))
+            response = {'ok': True}
+        except BaseException:
+            response = {'ok': False, 'error': traceback.format_exc()}
+        finally:
+            client.flush()
+            sys.stdout, sys.stderr = sys.__stdout__, sys.__stderr__
+        response['output'] = output.getvalue()
+        _send(self.request, json.dumps(response).encode())
+
+
+class _Server(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+    # wait for a job for at most a second before checking whether idle
+    timeout = 1
+
+    def __init__(self, path, idle):
+        super().__init__(path, _Handler)
+        self._last = time.time()
+        self._idle = idle
+
+    def process_request(self, request, client_address):
+        self._last = time.time()
+        request.settimeout(RECEIVE_WAIT)
+        try:
+            self.job = json.loads(_receive(request))
+        except (OSError, ValueError):
+            # e.g. a check that the daemon is running
+            self.shutdown_request(request)
+            return
+        request.settimeout(None)
+        prepare(self.job)
+        super().process_request(request, client_address)
+
+    def idle(self):
+        self.collect_children()
+        if self.active_children:
+            self._last = time.time()
+            return False
+        return time.time() - self._last > self._idle
+
+
+def serve(idle=DEFAULT_IDLE):
+    """ Runs the daemon in the current directory until it has been idle for
+    idle seconds.
+
+    Returns:
+        None
+    """
+    os.makedirs(os.path.dirname(SOCKET_FILE), exist_ok=True)
+    if os.path.exists(SOCKET_FILE):
+        os.remove(SOCKET_FILE)
+    server = _Server(SOCKET_FILE, idle)
+    os.chmod(SOCKET_FILE, 0o600)
+    _settings['serving'] = True
+    # imported once here rather than by every job
+    import ee  # noqa: F401
+    from snakemake import io, script  # noqa: F401
+    from geemake import (  # noqa: F401
+        benchmarks, cache, client, quota, session, tasks, utils,
+    )
+
+    try:
+        while not server.idle():
+            server.handle_request()
+    finally:
+        server.server_close()
+        if os.path.exists(SOCKET_FILE):
+            os.remove(SOCKET_FILE)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--idle', type=float, default=DEFAULT_IDLE,
+                        help='seconds without a job after which to exit')
+    args = parser.parse_args()
+    serve(args.idle)
+
+
+if __name__ == '__main__':
+    # the wrappers import geemake.daemon, which would otherwise be a
+    # separate copy of this module
+    from geemake import daemon
+    daemon.main()
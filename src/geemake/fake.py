@@ -0,0 +1,667 @@
+""" A local stand-in for the parts of Earth Engine that geemake uses.
+
+The fake backend replaces the functions in ee.data and ee.batch that geemake
+calls (getAsset, listAssets, listFeatures, deleteAsset, copyAsset,
+getTaskList, getTaskStatus, cancelTask and the Export.*.toAsset tasks) as
+well as the constructors of the common ee objects, so that whole workflows,
+including the rule scripts, run without a network connection or an Earth
+Engine account. Its state is kept in a SQLite database so that initialize,
+every wrapper process and the tests all see the same assets and tasks.
+
+It is enabled by setting the environment variable GEEMAKE_FAKE_EE, either to
+the path of the database or to a JSON object of options, or by setting the
+config key ee_fake to true or to a dictionary of options. The options are:
+
+    path: the database file, .snakemake/geemake/fake-ee.sqlite by default.
+    latency: seconds every request takes.
+    failure_rate: probability that a request fails with a transient error.
+    task_duration: seconds that every task runs for.
+    task_failure_rate: probability that a task ends in the FAILED state.
+    seed: seed for the random number generator used to inject failures.
+
+The fake cannot compute anything, objects built from the stand-ins only
+record how they were built and calling getInfo on them raises an exception.
+Only the features given to create_asset can be read back, with listFeatures.
+"""
+import contextlib
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+import ee
+
+DEFAULT_PATH = os.path.join('.snakemake', 'geemake', 'fake-ee.sqlite')
+ENV_VAR = 'GEEMAKE_FAKE_EE'
+
+DEFAULT_OPTIONS = {
+    'path': DEFAULT_PATH,
+    'latency': 0.0,
+    'failure_rate': 0.0,
+    'task_duration': 2.0,
+    'task_failure_rate': 0.0,
+    'seed': None,
+}
+
+# the ee objects that are replaced by stand-ins while the fake is installed
+STAND_INS = (
+    'Array', 'Date', 'Dictionary', 'Feature', 'FeatureCollection', 'Filter',
+    'Geometry', 'Image', 'ImageCollection', 'Join', 'List', 'Number',
+    'Reducer', 'String',
+)
+
+_lock = threading.Lock()
+_settings = {'options': None, 'random': random.Random(), 'originals': {}}
+
+
+def _env_options():
+    value = os.environ.get(ENV_VAR)
+    if not value:
+        return None
+    if value.lstrip().startswith('{'):
+        return json.loads(value)
+    if value.lower() in ('1', 'true', 'yes'):
+        return {}
+    return {'path': value}
+
+
+def configure(options=None):
+    """ Enables the fake backend with the given options.
+
+    Options from the GEEMAKE_FAKE_EE environment variable are used for any
+    option that is not given.
+
+    Args:
+        options: dictionary of options, see the module documentation, or
+            True to use the defaults.
+
+    Returns:
+        None
+    """
+    merged = dict(DEFAULT_OPTIONS)
+    merged.update(_env_options() or {})
+    if isinstance(options, dict):
+        merged.update(options)
+    _settings['options'] = merged
+    _settings['random'] = random.Random(merged['seed'])
+
+
+def enabled():
+    """ Returns True if the fake backend has been enabled. """
+    return _settings['options'] is not None or _env_options() is not None
+
+
+def options():
+    """ Returns the options of the fake backend. """
+    if _settings['options'] is None:
+        configure()
+    return _settings['options']
+
+
+def _timestamp(epoch):
+    utc_time = datetime.fromtimestamp(epoch, tz=timezone.utc)
+    return utc_time.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def _connect():
+    path = options()['path']
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    connection = sqlite3.connect(path, timeout=60)
+    connection.execute(
+        'CREATE TABLE IF NOT EXISTS assets ('
+        'id TEXT PRIMARY KEY, type TEXT, update_time REAL, '
+        'size_bytes INTEGER)'
+    )
+    connection.execute(
+        'CREATE TABLE IF NOT EXISTS tasks ('
+        'id TEXT PRIMARY KEY, state TEXT, description TEXT, type TEXT, '
+        'asset TEXT, created REAL, finishes REAL, fails INTEGER, '
+        'config TEXT)'
+    )
+    connection.execute(
+        'CREATE TABLE IF NOT EXISTS calls (operation TEXT PRIMARY KEY, '
+        'count INTEGER)'
+    )
+    connection.execute(
+        'CREATE TABLE IF NOT EXISTS features (asset TEXT, position INTEGER, '
+        'feature TEXT, PRIMARY KEY (asset, position))'
+    )
+    return connection
+
+
+def _request(operation):
+    """ Opens the database for one request, simulating latency and failures.
+    """
+    opts = options()
+    if opts['latency']:
+        time.sleep(opts['latency'])
+    connection = _connect()
+    with connection:
+        connection.execute(
+            'INSERT INTO calls VALUES (?, 1) ON CONFLICT(operation) '
+            'DO UPDATE SET count = count + 1',
+            (operation,),
+        )
+    with _lock:
+        failed = _settings['random'].random() < opts['failure_rate']
+    if failed:
+        connection.close()
+        raise ee.EEException(
+            f'{operation}: 503 Service Unavailable (injected by the fake '
+            f'Earth Engine backend)'
+        )
+    _advance(connection)
+    return connection
+
+
+def _advance(connection):
+    """ Finishes every task whose duration has passed. """
+    now = time.time()
+    with connection:
+        rows = connection.execute(
+            'SELECT id, asset, finishes, fails, type FROM tasks '
+            "WHERE state IN ('READY', 'RUNNING') AND finishes <= ?",
+            (now,),
+        ).fetchall()
+        for task_id, asset, finishes, fails, task_type in rows:
+            state = 'FAILED' if fails else 'COMPLETED'
+            connection.execute(
+                'UPDATE tasks SET state = ? WHERE id = ?', (state, task_id)
+            )
+            if fails or not asset:
+                continue
+            asset_type = 'IMAGE' if task_type == 'EXPORT_IMAGE' else 'TABLE'
+            connection.execute(
+                'INSERT OR REPLACE INTO assets VALUES (?, ?, ?, ?)',
+                (_strip(asset), asset_type, finishes, 1024),
+            )
+        connection.execute(
+            "UPDATE tasks SET state = 'RUNNING' WHERE state = 'READY'"
+        )
+
+
+def _asset_info(asset_id, asset_type, update_time, size_bytes):
+    return {
+        'type': asset_type,
+        'name': f'projects/earthengine-legacy/assets/{asset_id}',
+        'id': asset_id,
+        'updateTime': _timestamp(update_time),
+        'sizeBytes': str(size_bytes),
+    }
+
+
+def _not_found(asset_id):
+    return ee.EEException(f'Asset "{asset_id}" does not exist.')
+
+
+def _strip(asset_id):
+    prefix = 'projects/earthengine-legacy/assets/'
+    if asset_id.startswith(prefix):
+        asset_id = asset_id[len(prefix):]
+    return asset_id.rstrip('/')
+
+
+def create_asset(asset_id, asset_type='TABLE', update_time=None,
+                 size_bytes=1024, features=None):
+    """ Creates (or replaces) an asset in the fake backend.
+
+    Used to set up the true inputs of a workflow.
+
+    Args:
+        asset_id: string, path to the asset.
+        asset_type: string, the type of the asset, e.g. TABLE or IMAGE.
+        update_time: float, the update time of the asset in epoch time,
+            defaults to now.
+        size_bytes: int, the reported size of the asset.
+        features: iterable of GeoJSON features (dicts), the rows of a table
+            asset, see list_features.
+
+    Returns:
+        None
+    """
+    if update_time is None:
+        update_time = time.time()
+    connection = _connect()
+    with connection:
+        connection.execute(
+            'INSERT OR REPLACE INTO assets VALUES (?, ?, ?, ?)',
+            (_strip(asset_id), asset_type, update_time, size_bytes),
+        )
+        connection.execute(
+            'DELETE FROM features WHERE asset = ?', (_strip(asset_id),)
+        )
+        connection.executemany(
+            'INSERT INTO features VALUES (?, ?, ?)',
+            ((_strip(asset_id), i, json.dumps(x))
+             for i, x in enumerate(features or ())),
+        )
+    connection.close()
+
+
+def call_counts():
+    """ Returns the number of requests made to the fake, per operation. """
+    connection = _connect()
+    counts = dict(connection.execute('SELECT operation, count FROM calls'))
+    connection.close()
+    return counts
+
+
+def get_asset(asset_id):
+    """ Stand-in for ee.data.getAsset. """
+    connection = _request('getAsset')
+    asset_id = _strip(asset_id)
+    row = connection.execute(
+        'SELECT id, type, update_time, size_bytes FROM assets WHERE id = ?',
+        (asset_id,),
+    ).fetchone()
+    if row is None:
+        # folders exist as long as there are assets inside them
+        update_time, = connection.execute(
+            "SELECT MAX(update_time) FROM assets WHERE id LIKE ? ESCAPE '\\'",
+            (asset_id.replace('%', r'\%').replace('_', r'\_') + '/%',),
+        ).fetchone()
+        if update_time is not None:
+            row = (asset_id, 'FOLDER', update_time, 0)
+    connection.close()
+    if row is None:
+        raise _not_found(asset_id)
+    return _asset_info(*row)
+
+
+def list_assets(params):
+    """ Stand-in for ee.data.listAssets. """
+    if isinstance(params, str):
+        params = {'parent': params}
+    parent = _strip(params['parent'])
+    connection = _request('listAssets')
+    rows = connection.execute(
+        'SELECT id, type, update_time, size_bytes FROM assets '
+        "WHERE id LIKE ? ESCAPE '\\' ORDER BY id",
+        (parent.replace('%', r'\%').replace('_', r'\_') + '/%',),
+    ).fetchall()
+    connection.close()
+    if not rows:
+        raise _not_found(parent)
+
+    # direct children only, anything deeper shows up as a folder
+    children = {}
+    for asset_id, asset_type, update_time, size_bytes in rows:
+        name = asset_id[len(parent) + 1:]
+        if '/' in name:
+            folder = f'{parent}/{name.split("/")[0]}'
+            children.setdefault(folder, (folder, 'FOLDER', update_time, 0))
+        else:
+            children[asset_id] = (asset_id, asset_type, update_time,
+                                  size_bytes)
+    children = [_asset_info(*x) for x in children.values()]
+
+    start = int(params.get('pageToken') or 0)
+    page_size = int(params.get('pageSize') or len(children) or 1)
+    response = {'assets': children[start:start + page_size]}
+    if start + page_size < len(children):
+        response['nextPageToken'] = str(start + page_size)
+    return response
+
+
+def list_features(params):
+    """ Stand-in for ee.data.listFeatures. """
+    asset_id = _strip(params['assetId'])
+    start = int(params.get('pageToken') or 0)
+    page_size = int(params.get('pageSize') or 1000)
+    connection = _request('listFeatures')
+    exists = connection.execute(
+        'SELECT 1 FROM assets WHERE id = ?', (asset_id,)
+    ).fetchone()
+    rows = connection.execute(
+        'SELECT feature FROM features WHERE asset = ? AND position >= ? '
+        'ORDER BY position LIMIT ?',
+        (asset_id, start, page_size + 1),
+    ).fetchall()
+    connection.close()
+    if exists is None:
+        raise _not_found(asset_id)
+    response = {
+        'type': 'FeatureCollection',
+        'features': [json.loads(x) for x, in rows[:page_size]],
+    }
+    if len(rows) > page_size:
+        response['nextPageToken'] = str(start + page_size)
+    return response
+
+
+def delete_asset(asset_id):
+    """ Stand-in for ee.data.deleteAsset. """
+    connection = _request('deleteAsset')
+    asset_id = _strip(asset_id)
+    with connection:
+        children = connection.execute(
+            "SELECT 1 FROM assets WHERE id LIKE ? ESCAPE '\\' LIMIT 1",
+            (asset_id.replace('%', r'\%').replace('_', r'\_') + '/%',),
+        ).fetchone()
+        deleted = 0
+        if children is None:
+            deleted = connection.execute(
+                'DELETE FROM assets WHERE id = ?', (asset_id,)
+            ).rowcount
+    connection.close()
+    if children is not None:
+        raise ee.EEException(
+            f'Asset "{asset_id}" contains other assets and cannot be deleted.'
+        )
+    if not deleted:
+        raise _not_found(asset_id)
+
+
+def copy_asset(sourceId, destinationId, allowOverwrite=False):
+    """ Stand-in for ee.data.copyAsset. """
+    connection = _request('copyAsset')
+    with connection:
+        row = connection.execute(
+            'SELECT type, size_bytes FROM assets WHERE id = ?',
+            (_strip(sourceId),),
+        ).fetchone()
+        exists = connection.execute(
+            'SELECT 1 FROM assets WHERE id = ?', (_strip(destinationId),)
+        ).fetchone()
+        if row is not None and (allowOverwrite or exists is None):
+            connection.execute(
+                'INSERT OR REPLACE INTO assets VALUES (?, ?, ?, ?)',
+                (_strip(destinationId), row[0], time.time(), row[1]),
+            )
+    connection.close()
+    if row is None:
+        raise _not_found(sourceId)
+    if exists is not None and not allowOverwrite:
+        raise ee.EEException(f'Asset "{destinationId}" already exists.')
+
+
+def _task_info(task_id, state, description, task_type, asset, created,
+               finishes):
+    info = {
+        'id': task_id,
+        'name': f'projects/earthengine-legacy/operations/{task_id}',
+        'state': state,
+        'description': description,
+        'task_type': task_type,
+        'creation_timestamp_ms': int(created * 1000),
+        'start_timestamp_ms': int(created * 1000),
+        'update_timestamp_ms': int(min(time.time(), finishes) * 1000),
+        'destination_uris': [asset] if asset else [],
+    }
+    if state == 'COMPLETED':
+        info['batch_eecu_usage_seconds'] = finishes - created
+    return info
+
+
+_TASK_COLUMNS = 'id, state, description, type, asset, created, finishes'
+
+
+def get_task_list():
+    """ Stand-in for ee.data.getTaskList. """
+    connection = _request('getTaskList')
+    rows = connection.execute(
+        f'SELECT {_TASK_COLUMNS} FROM tasks ORDER BY created DESC'
+    ).fetchall()
+    connection.close()
+    return [_task_info(*row) for row in rows]
+
+
+def get_task_status(task_ids):
+    """ Stand-in for ee.data.getTaskStatus. """
+    if isinstance(task_ids, str):
+        task_ids = [task_ids]
+    connection = _request('getTaskStatus')
+    statuses = []
+    for task_id in task_ids:
+        row = connection.execute(
+            f'SELECT {_TASK_COLUMNS} FROM tasks WHERE id = ?', (task_id,)
+        ).fetchone()
+        if row is None:
+            statuses.append({'id': task_id, 'state': 'UNKNOWN'})
+        else:
+            statuses.append(_task_info(*row))
+    connection.close()
+    return statuses
+
+
+def cancel_task(task_id):
+    """ Stand-in for ee.data.cancelTask. """
+    connection = _request('cancelTask')
+    with connection:
+        connection.execute(
+            "UPDATE tasks SET state = 'CANCELLED' WHERE id = ? "
+            "AND state IN ('READY', 'RUNNING')",
+            (task_id,),
+        )
+    connection.close()
+
+
+class Expression:
+    """ Stand-in for an ee.ComputedObject that records how it was built.
+
+    Any method can be called on an expression, the result is a new
+    expression. Functions passed as arguments (e.g. to map) are called with
+    a placeholder so that their body is recorded too.
+    """
+
+    def __init__(self, name, *args, **kwargs):
+        self._name = name
+        self._args = args
+        self._kwargs = kwargs
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+
+        def method(*args, **kwargs):
+            return Expression(name, self, *args, **kwargs)
+        return method
+
+    def __repr__(self):
+        return self.serialize()
+
+    def serialize(self):
+        """ Returns a deterministic JSON description of the expression. """
+        return json.dumps(_encode(self), sort_keys=True)
+
+    def getInfo(self):
+        raise ee.EEException(
+            f'The fake Earth Engine backend cannot compute {self._name}.'
+        )
+
+
+def _encode(value):
+    if isinstance(value, Expression):
+        return {
+            'name': value._name,
+            'args': [_encode(x) for x in value._args],
+            'kwargs': {k: _encode(v) for k, v in value._kwargs.items()},
+        }
+    if isinstance(value, (list, tuple)):
+        return [_encode(x) for x in value]
+    if isinstance(value, dict):
+        return {str(k): _encode(v) for k, v in value.items()}
+    if callable(value):
+        return {'function': _encode(value(Expression('argument')))}
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return str(value)
+
+
+class _Constructor:
+    """ Stand-in for an ee class such as ee.FeatureCollection or ee.Filter.
+    """
+
+    def __init__(self, name):
+        self._name = name
+
+    def __call__(self, *args, **kwargs):
+        return Expression(self._name, *args, **kwargs)
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return _Constructor(f'{self._name}.{name}')
+
+
+class Task:
+    """ Stand-in for ee.batch.Task. """
+
+    def __init__(self, task_type, config):
+        self.id = None
+        self.task_type = task_type
+        self.config = config
+
+    def start(self):
+        """ Starts the task. No-op for started tasks.
+
+        Raises:
+            ee.EEException: if the priority of the task is not encoded as
+                the export builders encode it, see _request_config.
+        """
+        if self.id is not None:
+            return
+        priority = self.config.get('priority')
+        if priority is not None and not (
+                isinstance(priority, dict) and set(priority) == {'value'} and
+                isinstance(priority['value'], int)):
+            raise ee.EEException(
+                f'Invalid value at \'priority\' ({priority!r}), expected '
+                f'{{"value": int}}.'
+            )
+        opts = options()
+        with _lock:
+            fails = _settings['random'].random() < opts['task_failure_rate']
+        task_id = uuid.uuid4().hex.upper()[:24]
+        now = time.time()
+        connection = _request('startTask')
+        with connection:
+            connection.execute(
+                'INSERT INTO tasks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (
+                    task_id, 'READY', self.config.get('description'),
+                    self.task_type, self.config.get('assetId'), now,
+                    now + opts['task_duration'], int(fails),
+                    json.dumps(_encode(self.config), sort_keys=True),
+                ),
+            )
+        connection.close()
+        self.id = task_id
+
+    def status(self):
+        """ Returns the status of the task, see ee.data.getTaskStatus. """
+        if self.id is None:
+            return {'state': 'UNSUBMITTED'}
+        return get_task_status(self.id)[0]
+
+    def active(self):
+        """ Returns True if the task is READY or RUNNING. """
+        return self.status()['state'] in ('READY', 'RUNNING')
+
+    def cancel(self):
+        """ Cancels the task. """
+        cancel_task(self.id)
+
+
+def _request_config(description, asset, expression, kwargs):
+    """ Returns the config of a fake export task, with the priority wrapped
+    as the real builders do in the body of the request.
+    """
+    config = {
+        'description': description,
+        'assetId': asset,
+        'expression': expression,
+        **kwargs,
+    }
+    if config.get('priority') is not None:
+        config['priority'] = {'value': int(config['priority'])}
+    return config
+
+
+def _table_to_asset(collection, description='myExportTableTask',
+                    assetId=None, **kwargs):
+    return Task('EXPORT_FEATURES',
+                _request_config(description, assetId, collection, kwargs))
+
+
+def _image_to_asset(image, description='myExportImageTask', assetId=None,
+                    **kwargs):
+    return Task('EXPORT_IMAGE',
+                _request_config(description, assetId, image, kwargs))
+
+
+_REPLACEMENTS = {
+    (ee.data, 'getAsset'): get_asset,
+    (ee.data, 'listAssets'): list_assets,
+    (ee.data, 'listFeatures'): list_features,
+    (ee.data, 'deleteAsset'): delete_asset,
+    (ee.data, 'copyAsset'): copy_asset,
+    (ee.data, 'getTaskList'): get_task_list,
+    (ee.data, 'getTaskStatus'): get_task_status,
+    (ee.data, 'cancelTask'): cancel_task,
+    (ee.batch.Export.table, 'toAsset'): staticmethod(_table_to_asset),
+    (ee.batch.Export.image, 'toAsset'): staticmethod(_image_to_asset),
+}
+
+
+def install():
+    """ Replaces the parts of ee that geemake uses with the fake backend.
+
+    Returns:
+        None
+    """
+    with _lock:
+        if _settings['originals']:
+            return
+        originals = {}
+        for (owner, name), replacement in _REPLACEMENTS.items():
+            originals[(owner, name)] = owner.__dict__.get(name)
+            setattr(owner, name, replacement)
+        for name in STAND_INS:
+            originals[(ee, name)] = getattr(ee, name, None)
+            setattr(ee, name, _Constructor(name))
+        _settings['originals'] = originals
+
+
+def uninstall():
+    """ Restores the parts of ee replaced by install.
+
+    Returns:
+        None
+    """
+    with _lock:
+        for (owner, name), original in _settings['originals'].items():
+            setattr(owner, name, original)
+        _settings['originals'] = {}
+
+
+@contextlib.contextmanager
+def backend(options=None):
+    """ Runs the enclosed block against the fake backend.
+
+    The options and the installed state of the fake backend are restored
+    afterwards.
+
+    Args:
+        options: dictionary of options, see the module documentation.
+
+    Yields:
+        None
+    """
+    previous = dict(_settings)
+    installed = bool(_settings['originals'])
+    configure(options)
+    install()
+    try:
+        yield
+    finally:
+        if not installed:
+            uninstall()
+        _settings['options'] = previous['options']
+        _settings['random'] = previous['random']
@@ -1,14 +1,152 @@
 """ Allows Snake Make workflows to work with Earth Engine Assets.
 """
 import os
-import ee
-import geemap
-from geemake import utils
+import sys
 
-geemap.ee_initialize()
 
+def _is_ee_rule(rule, local_prefix):
+    return bool(rule.output) and all(local_prefix in x for x in rule.output)
 
-def initialize(rules, config):
+
+def _fusable(rules, consumers, local_prefix):
+    """ Returns the temporary outputs of earth engine rules that are only
+    read by other earth engine rules.
+    """
+    from snakemake.io import is_flagged
+
+    return {
+        file for rule in rules if _is_ee_rule(rule, local_prefix)
+        for file in rule.output
+        if is_flagged(file, 'temp') and file in consumers and all(
+            _is_ee_rule(x, local_prefix) for x in consumers[file]
+        )
+    }
+
+
+def _command_line_targets():
+    """ Returns the targets given to snakemake on the command line, None if
+    this is not a snakemake command line or it cannot be read.
+    """
+    program = sys.argv[0] if sys.argv else ''
+    if os.path.basename(program) == '__main__.py':  # python -m snakemake
+        program = os.path.dirname(program)
+    if 'snakemake' not in os.path.basename(program):
+        return None
+    try:
+        from snakemake import get_argument_parser
+        args, _ = get_argument_parser().parse_known_args(sys.argv[1:])
+    except (ImportError, SystemExit):
+        return None
+    return list(getattr(args, 'target', None) or [])
+
+
+def _default_target(rules):
+    for rule in rules:
+        workflow = getattr(rule, 'workflow', None)
+        if workflow is not None:
+            return getattr(workflow, 'default_target', None)
+    return None
+
+
+def _requested(rules, targets):
+    """ Returns the rules that the targets depend on.
+
+    Args:
+        rules: list of snakemake.rules.Rule.
+        targets: list of str, names of rules or files. An empty list stands
+            for the default target of the workflow.
+
+    Returns:
+        list of snakemake.rules.Rule: every rule needed to build the
+        targets, or all the rules if a target cannot be resolved.
+    """
+    if not targets:
+        default = _default_target(rules)
+        if default is None:
+            return rules
+        targets = [default]
+
+    by_name = {getattr(x, 'name', None): x for x in rules}
+    producers = {}
+    for rule in rules:
+        for file in rule.output:
+            producers[os.path.normpath(file)] = rule
+
+    stack = []
+    for target in targets:
+        if target in by_name:
+            stack.append(by_name[target])
+        elif os.path.normpath(target) in producers:
+            stack.append(producers[os.path.normpath(target)])
+        else:
+            # e.g. an output of a rule with wildcards, whose inputs are not
+            # known without resolving the whole DAG
+            return rules
+
+    requested = {}
+    while stack:
+        rule = stack.pop()
+        if id(rule) in requested:
+            continue
+        requested[id(rule)] = rule
+        for file in rule.input:
+            producer = producers.get(os.path.normpath(file))
+            if producer is not None:
+                stack.append(producer)
+    return [x for x in rules if id(x) in requested]
+
+
+def _critical_paths(rules):
+    """ Returns the length of the longest chain of rules that starts with
+    each rule.
+
+    A rule is followed by the rules that read one of its outputs, files are
+    matched by their path so outputs with wildcards end a chain.
+
+    Args:
+        rules: list of snakemake.rules.Rule.
+
+    Returns:
+        dict: mapping the name of each rule to the number of rules on the
+        longest chain from it to a rule whose outputs nothing reads, 1 for
+        the latter.
+    """
+    consumers = {}
+    for rule in rules:
+        for file in rule.input:
+            consumers.setdefault(os.path.normpath(file), []).append(rule)
+
+    def successors(rule):
+        return [
+            x for file in rule.output
+            for x in consumers.get(os.path.normpath(file), ())
+        ]
+
+    # iterative so that long chains do not hit the recursion limit, rules
+    # already on the stack are skipped so that a cycle cannot loop forever
+    lengths = {}
+    visiting = set()
+    for rule in rules:
+        stack = [(rule, False)]
+        while stack:
+            current, expanded = stack.pop()
+            if expanded:
+                visiting.discard(id(current))
+                lengths[id(current)] = 1 + max(
+                    (lengths.get(id(x), 0) for x in successors(current)),
+                    default=0,
+                )
+            elif id(current) not in lengths and id(current) not in visiting:
+                visiting.add(id(current))
+                stack.append((current, True))
+                stack.extend((x, False) for x in successors(current))
+    return {
+        x.name: lengths[id(x)] for x in rules
+        if getattr(x, 'name', None) is not None
+    }
+
+
+def initialize(rules, config, targets=None):
     """ Create local copies of all true input files if their gee assets exist.
 
     It is necessary to run this before running snakemake --summary to ensure
@@ -18,6 +156,11 @@ def initialize(rules, config):
     Raises an exception if the earth engine asset for a given input does not
     exist.
 
+    Only the inputs of the rules needed for the requested targets are
+    checked, so a run that targets one rule or output of a large workflow
+    costs as much as the part of the workflow it touches. The targets are
+    read from the snakemake command line unless they are given.
+
     This method should be called at the bottom of your snakefile to ensure it
     runs first.
 
@@ -26,7 +169,21 @@ def initialize(rules, config):
             `list(workflow.rules)`
         config: dictionary of snakemake configuration parameters, should have
             keys ee_prefix and local_prefix, accessible within a snakefile as
-            `config` after setting `configfile: /path/to/config.yaml'
+            `config` after setting `configfile: /path/to/config.yaml'. The
+            optional key ee_max_workers sets how many concurrent requests are
+            made to earth engine, and ee_project sets the Google Cloud project
+            used to initialize earth engine. Unless ee_fuse is false,
+            temporary outputs only read by other earth engine rules are not
+            exported. If ee_early_cutoff is true, an asset that is rewritten
+            with the same content does not make the rules that read it out
+            of date. Unless ee_priority is false, the rules on the longest
+            chains of rules are run first. See geemake.cache, geemake.client
+            and geemake.daemon for the keys that control the asset metadata
+            cache, the tracing of requests and the daemon that runs jobs.
+        targets: list of str, the names of the rules or the files that are
+            requested, an empty list for the default target. Defaults to the
+            targets on the snakemake command line, or to every rule if they
+            are not known.
 
     Returns:
         None
@@ -36,40 +193,132 @@ def initialize(rules, config):
         # therefore there is nothing to do
         return
 
+    # imported here so that workflows without earth engine rules never pay
+    # for importing the earth engine client
+    from geemake import cache, client, session, utils
+
+    session.configure(config)
+    cache.configure(config)
+    client.configure(config, rule='initialize')
+    client.start_run()
+
+    if config.get('ee_daemon'):
+        from geemake import daemon
+        daemon.start(config.get('ee_daemon_idle', daemon.DEFAULT_IDLE))
+
     all_inputs = set()
     all_outputs = set()
+    consumers = {}
     for rule in rules:
         for file in rule.input:
             all_inputs.add(file)
+            consumers.setdefault(file, []).append(rule)
         for file in rule.output:
             all_outputs.add(file)
 
-    true_inputs = [x for x in all_inputs if x not in all_outputs]
+    true_inputs = {x for x in all_inputs if x not in all_outputs}
+
+    # only the sentinels that the requested targets depend on are refreshed,
+    # along with those of their own outputs, which decide whether they run
+    if targets is None:
+        targets = _command_line_targets()
+    requested_rules = rules
+    if targets is not None:
+        requested_rules = _requested(rules, targets)
+    requested_inputs = {
+        file for rule in requested_rules
+        for file in (*rule.input, *rule.output) if file in all_inputs
+    }
 
     os.makedirs(config['local_prefix'], exist_ok=True)
 
-    for rule in rules:
-        for file in rule.input:
-            if config['local_prefix'] not in file:
-                continue  # not an ee input therefore do nothing
-
-            try:
-                asset = utils.check_update_time(file)
-                if asset is not None:
-                    utils.write_update_time(asset, file)
-            except ee.EEException:  # no remote copy, has a local copy
+    # temporary intermediates that are only read by other earth engine rules
+    # are never exported, the rules reading them compose the computation
+    # that creates them into their own
+    fused = set()
+    if config.get('ee_fuse', True):
+        fused = _fusable(rules, consumers, config['local_prefix'])
+    utils.write_fused(fused)
+
+    # intermediates that were not exported by an earlier run but are no
+    # longer fused, e.g. with ee_fuse turned off, track no asset: removing
+    # their local files makes the rules that create them run again
+    for file in requested_inputs:
+        if config['local_prefix'] in file and file not in fused and \
+                os.path.isfile(file) and utils.read_recipe(file):
+            os.remove(file)
+
+    # jobs on the longest chains of rules still to run are started first:
+    # snakemake schedules them first, the wrappers take task slots first and
+    # earth engine runs their tasks first, see ee_priority
+    priorities = {}
+    if config.get('ee_priority', True):
+        priorities = _critical_paths(requested_rules)
+        for rule in requested_rules:
+            if getattr(rule, 'priority', None) == 0 and \
+                    rule.name in priorities:
+                rule.priority = priorities[rule.name]
+    utils.write_priorities(priorities)
+
+    # each local file is resolved exactly once no matter how many rules
+    # consume it, the remote lookups for all of them are made concurrently,
+    # intermediates left from an interrupted run that were not exported
+    # have nothing to look up
+    ee_inputs = sorted(
+        x for x in requested_inputs if config['local_prefix'] in x and not (
+            x in fused and os.path.isfile(x) and utils.read_recipe(x)
+        )
+    )
+
+    tracked_assets = {}
+    for file in ee_inputs:
+        try:
+            tracked_assets[file], _ = utils.read_update_time(file)
+        except FileNotFoundError:
+            tracked_assets[file] = file.replace(
+                config['local_prefix'],
+                config['ee_prefix'],
+            )
+    update_times = utils.get_update_times(
+        tracked_assets.values(),
+        config['ee_prefix'],
+        config.get('ee_max_workers', utils.DEFAULT_MAX_WORKERS),
+    )
+
+    # assets rewritten since their local file was written, when early cutoff
+    # is on their content is checked before the local file is touched
+    rewritten = []
+    early_cutoff = config.get('ee_early_cutoff', False)
+    for file in ee_inputs:
+        asset = tracked_assets[file]
+        update_time = update_times[asset]
+        try:
+            _, local_update_time = utils.read_update_time(file)
+            if update_time is None:  # no remote copy, has a local copy
                 if file in true_inputs:
                     raise ValueError(
                         f'EE asset {asset} for {file} does not exist '
                         f'and is not created by a rule.'
                     )
                 os.remove(file)
-            except FileNotFoundError:
-                asset = file.replace(
-                    config['local_prefix'],
-                    config['ee_prefix'],
-                )
-                try:
-                    utils.write_update_time(asset, file)
-                except ee.EEException:
-                    pass
+            elif local_update_time != update_time:
+                if early_cutoff and utils.read_content(file) is not None:
+                    rewritten.append((asset, file))
+                else:
+                    utils.write_update_time(asset, file, update_time)
+        except FileNotFoundError:
+            if update_time is not None:
+                utils.write_update_time(asset, file, update_time)
+
+    if rewritten:
+        from concurrent.futures import ThreadPoolExecutor
+
+        max_workers = config.get('ee_max_workers', utils.DEFAULT_MAX_WORKERS)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            changed = executor.map(
+                lambda x: utils.refresh_update_time(*x), rewritten
+            )
+            for (asset, file), content_changed in zip(rewritten, changed):
+                if not content_changed:
+                    print(f'{asset} was rewritten with the same content, '
+                          f'not rerunning the rules that read {file}')
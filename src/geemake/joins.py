@@ -0,0 +1,149 @@
+""" Joins local tables to earth engine collections on the server.
+
+Looking up each row of a local table with its own
+`collection.filter(ee.Filter.eq(...)).first()` builds a computation that
+grows by a filter, a scan of the collection and a feature for every row. join
+instead sends the table once, as a list of dictionaries turned into features
+on the server, and matches every row with a single ee.Join:
+
+    def create_tasks(inputs, outputs):
+        cities = joins.join(inputs.asset, inputs.data, on='name')
+        return [(outputs[0], ee.batch.Export.table.toAsset(
+            collection=cities, assetId=outputs[0]))]
+
+Tables too large to send with every computation that uses them can be
+stored as a table asset once with upload, and the asset joined instead. See
+benchmarks/joins.py for how the two approaches compare.
+"""
+import json
+import os
+import sys
+
+import ee
+
+DEFAULT_BATCH_SIZE = 5000
+
+# property that holds the matching row while the join is applied
+MATCH = 'geemake:match'
+
+
+def read_table(table):
+    """ Returns the rows of a local table.
+
+    Args:
+        table: a pandas.DataFrame, the path to a CSV file or a list of
+            dictionaries.
+
+    Returns:
+        list of dict: one dictionary per row, missing values are None.
+    """
+    if isinstance(table, list):
+        return table
+    import pandas as pd
+
+    if not isinstance(table, pd.DataFrame):
+        table = pd.read_csv(str(table))
+    # through json so that numpy values become plain numbers and NaN None
+    return json.loads(table.to_json(orient='records'))
+
+
+def _is_local(table):
+    if isinstance(table, (list, os.PathLike)):
+        return True
+    if isinstance(table, str):
+        return table.lower().endswith('.csv')
+    pd = sys.modules.get('pandas')
+    return pd is not None and isinstance(table, pd.DataFrame)
+
+
+def _to_feature(properties):
+    return ee.Feature(None, ee.Dictionary(properties))
+
+
+def table_collection(table, batch_size=DEFAULT_BATCH_SIZE):
+    """ Returns an ee.FeatureCollection with a feature for every row of a
+    local table.
+
+    The rows are sent as lists of at most batch_size dictionaries that the
+    server turns into features, rather than as one ee.Feature per row.
+
+    Args:
+        table: a pandas.DataFrame, the path to a CSV file or a list of
+            dictionaries, see read_table.
+        batch_size: int, the most rows per list.
+
+    Returns:
+        ee.FeatureCollection: features without geometries whose properties
+        are the columns of the table.
+    """
+    rows = read_table(table)
+    batches = [
+        ee.FeatureCollection(
+            ee.List(rows[i:i + batch_size]).map(_to_feature)
+        )
+        for i in range(0, len(rows), batch_size)
+    ]
+    if len(batches) == 1:
+        return batches[0]
+    return ee.FeatureCollection(batches).flatten()
+
+
+def upload(table, asset, batch_size=DEFAULT_BATCH_SIZE):
+    """ Returns a task that stores a local table as an ee table asset.
+
+    Return it from create_tasks so that the table is sent once and later
+    rules join the asset instead.
+
+    Args:
+        table: a pandas.DataFrame, the path to a CSV file or a list of
+            dictionaries, see read_table.
+        asset: str, path to the ee asset to create.
+        batch_size: int, see table_collection.
+
+    Returns:
+        ee.batch.Task: the export task, not started.
+    """
+    return ee.batch.Export.table.toAsset(
+        collection=table_collection(table, batch_size),
+        description=f'upload_{asset.rstrip("/").rpartition("/")[2]}',
+        assetId=asset,
+    )
+
+
+def join(collection, table, on, table_on=None, batch_size=DEFAULT_BATCH_SIZE):
+    """ Copies the columns of a table onto the features they match.
+
+    Every feature of collection whose property on equals the column
+    table_on of a row of table gets the columns of the first such row,
+    features without a match are dropped.
+
+    Args:
+        collection: ee.FeatureCollection or str, path to an ee table asset.
+        table: a pandas.DataFrame, the path to a CSV file, a list of
+            dictionaries, an ee.FeatureCollection or the path to an ee table
+            asset (e.g. one created with upload).
+        on: str, the property of collection to match on.
+        table_on: str, the column of table to match on, defaults to on.
+        batch_size: int, see table_collection.
+
+    Returns:
+        ee.FeatureCollection: the matched features.
+    """
+    if isinstance(collection, str):
+        collection = ee.FeatureCollection(collection)
+    if _is_local(table):
+        rows = table_collection(table, batch_size)
+    else:
+        rows = ee.FeatureCollection(table)
+
+    condition = ee.Filter.equals(leftField=on, rightField=table_on or on)
+    joined = ee.Join.saveFirst(matchKey=MATCH).apply(
+        collection, rows, condition
+    )
+
+    def merge(feature):
+        feature = ee.Feature(feature)
+        match = ee.Feature(feature.get(MATCH))
+        names = feature.propertyNames().remove(MATCH)
+        return ee.Feature(feature.select(names).copyProperties(match))
+    return ee.FeatureCollection(joined.map(merge))
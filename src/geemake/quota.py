@@ -0,0 +1,168 @@
+""" Limits how many Earth Engine tasks the whole workflow runs at once.
+
+Earth Engine caps the number of batch tasks an account can run concurrently.
+When the config key ee_max_tasks is set, every wrapper takes a slot before
+starting a task and gives it back as soon as the task finishes. The slots are
+shared by all the wrapper processes of a workflow through a SQLite database
+under .snakemake/geemake/, tasks waiting for a slot are served in order of
+priority (highest first) and then in the order they asked for one.
+
+Slots held by processes that no longer exist are reclaimed, so the limit is
+only enforced between processes on the same machine.
+"""
+import os
+import sqlite3
+import time
+
+QUOTA_FILE = os.path.join('.snakemake', 'geemake', 'quota.sqlite')
+
+_settings = {'limit': None, 'path': QUOTA_FILE}
+
+
+def configure(config):
+    """ Sets the task limit from a snakemake config.
+
+    Args:
+        config: dictionary of snakemake configuration parameters, the key
+            ee_max_tasks (the most tasks to run at once, unlimited if not
+            set) is used.
+
+    Returns:
+        None
+    """
+    limit = config.get('ee_max_tasks')
+    _settings['limit'] = int(limit) if limit else None
+
+
+def enabled():
+    """ Returns True if the number of concurrent tasks is limited. """
+    return _settings['limit'] is not None
+
+
+def _connect():
+    os.makedirs(os.path.dirname(_settings['path']), exist_ok=True)
+    connection = sqlite3.connect(
+        _settings['path'], timeout=60, isolation_level=None
+    )
+    connection.execute(
+        'CREATE TABLE IF NOT EXISTS tickets ('
+        'id INTEGER PRIMARY KEY AUTOINCREMENT, pid INTEGER, '
+        'priority INTEGER, running INTEGER, created REAL)'
+    )
+    return connection
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def enqueue(priority=0):
+    """ Joins the queue for a task slot.
+
+    Args:
+        priority: int, tickets with a higher priority are served first.
+
+    Returns:
+        int or None: a ticket to pass to try_acquire and release, None if
+        the number of tasks is not limited.
+    """
+    if not enabled():
+        return None
+    connection = _connect()
+    cursor = connection.execute(
+        'INSERT INTO tickets (pid, priority, running, created) '
+        'VALUES (?, ?, 0, ?)',
+        (os.getpid(), priority, time.time()),
+    )
+    connection.close()
+    return cursor.lastrowid
+
+
+def hold(priority=0):
+    """ Takes a task slot for a task that is already running, e.g. one
+    resumed from an interrupted run, whether or not a slot is free.
+
+    The workflow may run more than the limit until enough tasks finish, but
+    the task is counted so that no other task is started in its place.
+
+    Args:
+        priority: int, recorded with the ticket, see enqueue.
+
+    Returns:
+        int or None: a ticket to pass to release, None if the number of
+        tasks is not limited.
+    """
+    if not enabled():
+        return None
+    connection = _connect()
+    cursor = connection.execute(
+        'INSERT INTO tickets (pid, priority, running, created) '
+        'VALUES (?, ?, 1, ?)',
+        (os.getpid(), priority, time.time()),
+    )
+    connection.close()
+    return cursor.lastrowid
+
+
+def try_acquire(ticket):
+    """ Takes a task slot for ticket if one is free and it is ticket's turn.
+
+    Args:
+        ticket: int, as returned by enqueue.
+
+    Returns:
+        bool: True if ticket now holds a slot.
+    """
+    if ticket is None:
+        return True
+    connection = _connect()
+    try:
+        connection.execute('BEGIN IMMEDIATE')
+        pids = connection.execute('SELECT DISTINCT pid FROM tickets')
+        dead = [(pid,) for pid, in pids.fetchall() if not _alive(pid)]
+        connection.executemany('DELETE FROM tickets WHERE pid = ?', dead)
+
+        running, = connection.execute(
+            'SELECT COUNT(*) FROM tickets WHERE running = 1'
+        ).fetchone()
+        free = _settings['limit'] - running
+        turn = connection.execute(
+            'SELECT id FROM tickets WHERE running = 0 '
+            'ORDER BY priority DESC, id LIMIT ?',
+            (max(free, 0),),
+        ).fetchall()
+        acquired = (ticket,) in turn
+        if acquired:
+            connection.execute(
+                'UPDATE tickets SET running = 1 WHERE id = ?', (ticket,)
+            )
+        connection.execute('COMMIT')
+    except BaseException:
+        if connection.in_transaction:
+            connection.execute('ROLLBACK')
+        raise
+    finally:
+        connection.close()
+    return acquired
+
+
+def release(ticket):
+    """ Gives back the slot (or the place in the queue) held by ticket.
+
+    Args:
+        ticket: int, as returned by enqueue.
+
+    Returns:
+        None
+    """
+    if ticket is None:
+        return
+    connection = _connect()
+    connection.execute('DELETE FROM tickets WHERE id = ?', (ticket,))
+    connection.close()
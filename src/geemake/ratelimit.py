@@ -0,0 +1,100 @@
+""" Limits how fast the whole workflow sends requests to Earth Engine.
+
+Earth Engine answers requests beyond a project's rate limit with 429 errors.
+When the config key ee_rate_limit is set, every request made through
+geemake.client first takes a token from a bucket that refills at
+ee_rate_limit tokens per second and holds at most ee_rate_burst tokens
+(defaults to one second's worth). The bucket is shared by all the threads
+and processes of a workflow through a SQLite database under
+.snakemake/geemake/, so the limit holds no matter how many jobs run at once.
+"""
+import os
+import sqlite3
+import time
+
+RATE_FILE = os.path.join('.snakemake', 'geemake', 'ratelimit.sqlite')
+
+_settings = {'rate': None, 'burst': None, 'path': RATE_FILE}
+
+
+def configure(config):
+    """ Sets the rate limit from a snakemake config.
+
+    Args:
+        config: dictionary of snakemake configuration parameters, the keys
+            ee_rate_limit (requests per second, unlimited if not set) and
+            ee_rate_burst (the most requests made at once after a pause) are
+            used.
+
+    Returns:
+        None
+    """
+    rate = config.get('ee_rate_limit')
+    _settings['rate'] = float(rate) if rate else None
+    burst = config.get('ee_rate_burst')
+    _settings['burst'] = float(burst) if burst else _settings['rate']
+
+
+def enabled():
+    """ Returns True if the rate of requests is limited. """
+    return _settings['rate'] is not None
+
+
+def _connect():
+    os.makedirs(os.path.dirname(_settings['path']), exist_ok=True)
+    connection = sqlite3.connect(
+        _settings['path'], timeout=60, isolation_level=None
+    )
+    connection.execute(
+        'CREATE TABLE IF NOT EXISTS bucket ('
+        'id INTEGER PRIMARY KEY CHECK (id = 0), tokens REAL, updated REAL)'
+    )
+    return connection
+
+
+def _take():
+    """ Takes a token if there is one, returns how long to wait if not. """
+    rate = _settings['rate']
+    burst = max(_settings['burst'], 1)
+    connection = _connect()
+    try:
+        connection.execute('BEGIN IMMEDIATE')
+        row = connection.execute(
+            'SELECT tokens, updated FROM bucket WHERE id = 0'
+        ).fetchone()
+        now = time.time()
+        tokens, updated = row if row is not None else (burst, now)
+        tokens = min(burst, tokens + max(now - updated, 0) * rate)
+        delay = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            delay = (1 - tokens) / rate
+        connection.execute(
+            'INSERT OR REPLACE INTO bucket VALUES (0, ?, ?)', (tokens, now)
+        )
+        connection.execute('COMMIT')
+    except BaseException:
+        if connection.in_transaction:
+            connection.execute('ROLLBACK')
+        raise
+    finally:
+        connection.close()
+    return delay
+
+
+def acquire():
+    """ Waits until the next request may be made.
+
+    Returns:
+        float: the number of seconds waited.
+    """
+    if not enabled():
+        return 0.0
+    waited = 0.0
+    while True:
+        delay = _take()
+        if not delay:
+            return waited
+        time.sleep(delay)
+        waited += delay
@@ -0,0 +1,68 @@
+""" Lazily initializes the Earth Engine session.
+
+Importing geemake does not authenticate with Earth Engine, the session is
+only initialized right before the first call that needs it.
+"""
+import os
+import threading
+
+import ee
+
+from geemake import fake
+
+_lock = threading.Lock()
+_settings = {'project': None, 'initialized': False}
+
+
+def configure(config):
+    """ Sets the session options from a snakemake config.
+
+    Args:
+        config: dictionary of snakemake configuration parameters, the keys
+            ee_project (the Google Cloud project to use with Earth Engine,
+            defaults to the EE_PROJECT_ID environment variable) and ee_fake
+            (options for the fake backend, see geemake.fake) are used.
+
+    Returns:
+        None
+    """
+    _settings['project'] = config.get('ee_project', _settings['project'])
+    if config.get('ee_fake'):
+        fake.configure(config['ee_fake'])
+
+
+def project():
+    """ Returns the Google Cloud project used with Earth Engine, None for the
+    default (legacy) project.
+    """
+    return _settings['project'] or os.environ.get('EE_PROJECT_ID')
+
+
+def is_initialized():
+    """ Returns True if an Earth Engine session has been initialized. """
+    if _settings['initialized']:
+        return True
+    if hasattr(ee.data, 'is_initialized'):
+        return ee.data.is_initialized()
+    return False
+
+
+def initialize():
+    """ Initializes Earth Engine if it has not been initialized yet.
+
+    Safe to call from many threads, only the first call does any work. If
+    the fake backend is enabled it is installed instead.
+
+    Returns:
+        None
+    """
+    if is_initialized():
+        return
+    with _lock:
+        if is_initialized():
+            return
+        if fake.enabled():
+            fake.install()
+        else:
+            ee.Initialize(project=project())
+        _settings['initialized'] = True
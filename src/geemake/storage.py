@@ -0,0 +1,227 @@
+""" A Snakemake storage plugin for earth engine assets.
+
+With Snakemake 8 or later, rules can name earth engine assets directly as
+`storage.ee("ee://<asset>")` (or as `ee://<asset>` with
+`--default-storage-provider ee`) instead of tracking them with local files
+under local_prefix and calling geemake.initialize. `<asset>` is either the
+full id of the asset, e.g. `projects/my-project/assets/folder/asset` or
+`users/me/folder/asset`, or `my-project/folder/asset` for the asset
+`folder/asset` of the Cloud project `my-project`.
+
+Whether assets exist and when they were last updated is found by listing
+their folder, once per folder, and the listing is kept for the rest of the
+evaluation of the DAG, so checking the inputs of a workflow costs one
+request per folder. The local copy of an asset is a file holding its id and
+update time, under .snakemake/storage/ee/ (Snakemake's default local
+storage prefix), which wrapper.py resolves back to the asset. Outputs are
+created by the tasks of the rule, storing them only checks that they exist.
+
+Snakemake finds the plugin through the snakemake_storage_plugin_ee package,
+which re-exports the classes defined here.
+"""
+import threading
+from dataclasses import dataclass, field
+from typing import Iterable, List, Optional
+from urllib.parse import urlparse
+
+from snakemake_interface_storage_plugins.common import Operation
+from snakemake_interface_storage_plugins.io import Mtime, get_constant_prefix
+from snakemake_interface_storage_plugins.settings import (
+    StorageProviderSettingsBase,
+)
+from snakemake_interface_storage_plugins.storage_object import (
+    StorageObjectGlob,
+    StorageObjectRead,
+    StorageObjectWrite,
+)
+from snakemake_interface_storage_plugins.storage_provider import (
+    ExampleQuery,
+    QueryType,
+    StorageProviderBase,
+    StorageQueryValidationResult,
+)
+
+from geemake import session, utils
+
+SCHEME = 'ee'
+
+
+def asset_id(query):
+    """ Returns the id of the earth engine asset named by an ee:// query.
+
+    Args:
+        query: str, e.g. ee://my-project/folder/asset.
+
+    Returns:
+        str: the id of the asset, e.g.
+        projects/my-project/assets/folder/asset.
+    """
+    parsed = urlparse(query)
+    path = (parsed.netloc + parsed.path).strip('/')
+    if path.startswith(('projects/', 'users/')):
+        return path
+    project, _, rest = path.partition('/')
+    return f'projects/{project}/assets/{rest}'
+
+
+@dataclass
+class StorageProviderSettings(StorageProviderSettingsBase):
+    project: Optional[str] = field(
+        default=None,
+        metadata={
+            'help': 'The Google Cloud project used to initialize earth '
+                    'engine, defaults to the EE_PROJECT_ID environment '
+                    'variable.',
+            'env_var': False,
+            'required': False,
+        },
+    )
+
+
+class StorageProvider(StorageProviderBase):
+
+    def __post_init__(self):
+        # listings of the folders seen so far, empty for folders that do not
+        # exist
+        self._listings = {}
+        self._lock = threading.Lock()
+        if self.settings is not None and self.settings.project:
+            session.configure({'ee_project': self.settings.project})
+
+    @classmethod
+    def example_queries(cls) -> List[ExampleQuery]:
+        return [
+            ExampleQuery(
+                query='ee://my-project/folder/asset',
+                description='the asset folder/asset of the Cloud project '
+                            'my-project',
+                type=QueryType.ANY,
+            ),
+            ExampleQuery(
+                query='ee://users/me/folder/asset',
+                description='an asset given by its full id',
+                type=QueryType.ANY,
+            ),
+        ]
+
+    def rate_limiter_key(self, query: str, operation: Operation):
+        return SCHEME
+
+    def default_max_requests_per_second(self) -> float:
+        return 10.0
+
+    def use_rate_limiter(self) -> bool:
+        # requests are paced and retried by geemake.client
+        return False
+
+    @classmethod
+    def is_valid_query(cls, query: str) -> StorageQueryValidationResult:
+        parsed = urlparse(query)
+        if parsed.scheme != SCHEME:
+            return StorageQueryValidationResult(
+                query=query, valid=False,
+                reason=f'must start with {SCHEME}://',
+            )
+        if len(asset_id(query).split('/')) < 3:
+            return StorageQueryValidationResult(
+                query=query, valid=False,
+                reason='must name an asset inside a project or user folder',
+            )
+        return StorageQueryValidationResult(query=query, valid=True)
+
+    def listing(self, folder):
+        """ Returns the assets directly inside folder, listing it only once.
+
+        Args:
+            folder: str, the id of an earth engine folder.
+
+        Returns:
+            dict: mapping the name of each child asset to its listing, empty
+            if the folder does not exist.
+        """
+        with self._lock:
+            if folder in self._listings:
+                return self._listings[folder]
+        listing = utils._try_list_assets(folder)
+        with self._lock:
+            return self._listings.setdefault(folder, listing)
+
+    def forget(self, folder):
+        """ Drops the listing of folder, e.g. after one of its assets
+        changed.
+        """
+        with self._lock:
+            self._listings.pop(folder, None)
+
+
+class StorageObject(StorageObjectRead, StorageObjectWrite, StorageObjectGlob):
+
+    def __post_init__(self):
+        self.asset = asset_id(self.query)
+        self.folder, self.name = utils.split_asset(self.asset)
+
+    def _info(self):
+        return self.provider.listing(self.folder).get(self.name)
+
+    async def inventory(self, cache):
+        """ Records whether every asset in the folder of this one exists and
+        when it was updated, from a single listing of the folder.
+        """
+        if self.cache_key() in cache.exists_in_storage:
+            return
+        listing = self.provider.listing(self.folder)
+        for name, info in listing.items():
+            key = str(self.provider.local_prefix / f'{self.folder}/{name}')
+            cache.exists_in_storage[key] = True
+            cache.mtime[key] = Mtime(
+                storage=utils.epoch_time(info['updateTime'])
+            )
+            cache.size[key] = int(info.get('sizeBytes', 0))
+        cache.exists_in_storage.setdefault(self.cache_key(), False)
+
+    def get_inventory_parent(self) -> Optional[str]:
+        return f'{SCHEME}://{self.folder}'
+
+    def local_suffix(self) -> str:
+        return self.asset
+
+    def cleanup(self):
+        pass
+
+    def exists(self) -> bool:
+        return self._info() is not None
+
+    def mtime(self) -> float:
+        return utils.epoch_time(self._info()['updateTime'])
+
+    def size(self) -> int:
+        info = self._info()
+        return int(info.get('sizeBytes', 0)) if info else 0
+
+    def local_footprint(self) -> int:
+        # only the id and update time of the asset are kept locally
+        return 0
+
+    def retrieve_object(self):
+        self.local_path().parent.mkdir(parents=True, exist_ok=True)
+        utils.write_update_time(self.asset, str(self.local_path()),
+                                self.mtime())
+
+    def store_object(self):
+        # the tasks of the rule have already created the asset
+        self.provider.forget(self.folder)
+        if not self.exists():
+            raise FileNotFoundError(
+                f'EE asset {self.asset} was not created by its rule.'
+            )
+
+    def remove(self):
+        utils.delete_assets([self.asset])
+        self.provider.forget(self.folder)
+
+    def list_candidate_matches(self) -> Iterable[str]:
+        prefix = get_constant_prefix(self.query, strip_incomplete_parts=True)
+        if not prefix.endswith('/'):
+            return []
+        folder = asset_id(prefix).rstrip('/')
+        return [prefix + name for name in self.provider.listing(folder)]
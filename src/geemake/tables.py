@@ -0,0 +1,177 @@
+""" Copies earth engine tables into local Parquet files for non-EE rules.
+
+Calling getInfo on a whole FeatureCollection runs into the memory and
+payload limits of earth engine. to_parquet instead pages through a table
+asset with ee.data.listFeatures and writes every page to the Parquet file as
+its own row group, so only one page is held in memory whatever the size of
+the table. Rules can then read the file with pandas or memory-map it with
+pyarrow:
+
+    rule table:
+        input: ".local/canadian-cities"
+        output: "canadian-cities.parquet"
+        run:
+            from geemake import tables
+            tables.to_parquet(input[0], output[0], config=config)
+
+Each row holds the id of a feature (as system:index), its properties and,
+unless geometry is false, its geometry as a GeoJSON string. Properties whose
+values are lists or dictionaries are stored as JSON strings. Columns are
+typed from the first page, so whole numbers such as ids and counts stay
+integers (Arrow allows nulls in them). Writing Parquet needs pyarrow.
+"""
+import json
+import os
+
+from geemake import cache, client, session, utils
+
+DEFAULT_PAGE_SIZE = 1000
+INDEX = 'system:index'
+GEOMETRY = 'geometry'
+
+
+def iter_features(asset, page_size=DEFAULT_PAGE_SIZE):
+    """ Yields the features of a table asset a page at a time.
+
+    Args:
+        asset: str, path to an ee table asset.
+        page_size: int, number of features to request per page.
+
+    Yields:
+        list of dict: the GeoJSON features of a page.
+    """
+    page_token = None
+    while True:
+        params = {'assetId': asset, 'pageSize': page_size}
+        if page_token is not None:
+            params['pageToken'] = page_token
+        response = client.call('listFeatures', params, target=asset)
+        yield response.get('features', [])
+        page_token = response.get('nextPageToken') or \
+            response.get('next_page_token')
+        if not page_token:
+            return
+
+
+def _value(value):
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, sort_keys=True)
+    return value
+
+
+def _rows(features, geometry):
+    rows = []
+    for feature in features:
+        row = {INDEX: feature.get('id')}
+        for name, value in (feature.get('properties') or {}).items():
+            row[name] = _value(value)
+        if geometry:
+            shape = feature.get('geometry')
+            row[GEOMETRY] = None if shape is None else json.dumps(shape)
+        rows.append(row)
+    return rows
+
+
+def _schema(pa, rows):
+    """ Infers the schema of a table from its first page of rows. """
+    fields = []
+    for field in pa.Table.from_pylist(rows).schema:
+        if pa.types.is_null(field.type):
+            field = field.with_type(pa.string())
+        fields.append(field)
+    return pa.schema(fields)
+
+
+def _fractions(pa, schema, rows):
+    """ Returns the integer columns of schema that rows hold fractions in,
+    which pyarrow would otherwise truncate.
+    """
+    integers = {x.name for x in schema if pa.types.is_integer(x.type)}
+    return {
+        k for row in rows for k, v in row.items()
+        if k in integers and isinstance(v, float) and not v.is_integer()
+    }
+
+
+def to_parquet(asset, path, page_size=DEFAULT_PAGE_SIZE, geometry=True,
+               schema=None, config=None):
+    """ Writes the features of a table asset to a Parquet file.
+
+    The file is written under a temporary name and moved into place once
+    every page has been written, so a failed copy leaves no partial file.
+
+    Args:
+        asset: str, path to an ee table asset or to a local file used to
+            track one.
+        path: str, the Parquet file to write.
+        page_size: int, number of features to request, and to write to each
+            row group, at a time.
+        geometry: bool, if False the geometries of the features are left out.
+        schema: pyarrow.Schema, the columns of the file, inferred from the
+            first page of features if not given. Give it when a property is
+            missing from, or always null in, the first page.
+        config: dictionary of snakemake configuration parameters, used to
+            set up earth engine like the wrapper does, see
+            geemake.initialize.
+
+    Returns:
+        int: the number of features written.
+
+    Raises:
+        ValueError: if a feature has a property that is not in the schema,
+            or a fraction in a column that is an integer in the schema.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError('geemake.tables.to_parquet needs pyarrow') from e
+
+    if config is not None:
+        session.configure(config)
+        cache.configure(config)
+        client.configure(config)
+    if os.path.isfile(asset):
+        asset, _ = utils.read_update_time(asset)
+
+    partial = f'{path}.part'
+    writer = None
+    written = 0
+    try:
+        for features in iter_features(asset, page_size):
+            rows = _rows(features, geometry)
+            if not rows:
+                continue
+            if schema is None:
+                schema = _schema(pa, rows)
+            unknown = {k for row in rows for k in row} - set(schema.names)
+            if unknown:
+                raise ValueError(
+                    f'Features of {asset} have properties {sorted(unknown)} '
+                    f'that are not in the schema {schema.names}, pass a '
+                    f'schema that includes them.'
+                )
+            fractions = _fractions(pa, schema, rows)
+            if fractions:
+                raise ValueError(
+                    f'Features of {asset} have fractional values in the '
+                    f'integer columns {sorted(fractions)}, pass a schema '
+                    f'that makes them pa.float64().'
+                )
+            if writer is None:
+                writer = pq.ParquetWriter(partial, schema)
+            writer.write_table(pa.Table.from_pylist(rows, schema=schema))
+            written += len(rows)
+        if writer is None:
+            if schema is None:
+                schema = pa.schema([(INDEX, pa.string())])
+            writer = pq.ParquetWriter(partial, schema)
+        writer.close()
+        writer = None
+        os.replace(partial, path)
+    finally:
+        if writer is not None:
+            writer.close()
+        if os.path.exists(partial):
+            os.remove(partial)
+    return written
@@ -0,0 +1,220 @@
+""" Monitors Earth Engine batch tasks.
+"""
+import random
+import time
+
+from geemake import client
+
+# states of a started task that has not finished yet
+ACTIVE_STATES = ('READY', 'RUNNING')
+
+# the shortest and longest default intervals between checks, in seconds
+MIN_WAIT = 1
+DEFAULT_MAX_WAIT = 60
+
+# growth of the interval between checks while no task finishes
+BACKOFF_FACTOR = 1.5
+
+# each interval is shortened by up to this fraction at random
+JITTER = 0.25
+
+# longest interval between attempts to start a queued task, in seconds
+QUEUE_WAIT = 2
+
+# default number of tasks a single monitor keeps started at once
+DEFAULT_WINDOW = 1000
+
+# the priority earth engine gives tasks of a Cloud project by default, and
+# the highest it accepts
+DEFAULT_PRIORITY = 100
+MAX_PRIORITY = 9999
+
+_DONE = object()
+
+
+def get_task_statuses(task_ids):
+    """ Returns the statuses of many EE tasks.
+
+    All of the statuses are read from a single listing of the user's tasks,
+    tasks that are too new to appear in the listing are looked up by id.
+
+    Args:
+        task_ids: iterable of strings, the ids of started earth engine tasks.
+
+    Returns:
+        dict: mapping each task id to its status, a dict with the task's
+        state and, once it has finished, e.g. its batch_eecu_usage_seconds.
+    """
+    task_ids = set(task_ids)
+    statuses = {
+        task['id']: task for task in client.call('getTaskList')
+        if task['id'] in task_ids
+    }
+    missing = task_ids - statuses.keys()
+    if missing:
+        missing = sorted(missing)
+        for task in client.call('getTaskStatus', missing,
+                                target=','.join(missing)):
+            statuses[task['id']] = task
+    return statuses
+
+
+def get_task_states(task_ids):
+    """ Returns the states of many EE tasks, see get_task_statuses.
+
+    Args:
+        task_ids: iterable of strings, the ids of started earth engine tasks.
+
+    Returns:
+        dict: mapping each task id to its state, e.g. RUNNING or COMPLETED.
+    """
+    return {
+        task_id: status['state']
+        for task_id, status in get_task_statuses(task_ids).items()
+    }
+
+
+def task_priority(priority):
+    """ Returns the earth engine priority of a task of a rule.
+
+    Args:
+        priority: int, the priority of the rule, e.g. the length of the
+            longest chain of rules that starts with it, see
+            geemake.initialize. 1 and below get the default priority.
+
+    Returns:
+        int: a priority accepted by earth engine, higher priorities are run
+        sooner.
+    """
+    return min(DEFAULT_PRIORITY + max(priority - 1, 0), MAX_PRIORITY)
+
+
+def set_priority(task, priority):
+    """ Gives an export task that has not been started the earth engine
+    priority of its rule, unless the rule script already set one.
+
+    The export builders have already turned the task's options into the
+    body of the request to earth engine, in which the priority is a wrapped
+    integer, {'value': int}.
+
+    Args:
+        task: ee.batch.Task, an export task that has not been started.
+        priority: int, the priority of the rule, see task_priority.
+
+    Returns:
+        None
+    """
+    if 'priority' not in task.config:
+        task.config['priority'] = {'value': task_priority(priority)}
+
+
+def backoff(attempt, wait, max_wait=DEFAULT_MAX_WAIT):
+    """ Returns how long to wait before the next check of a set of tasks.
+
+    The interval grows exponentially with the number of checks that have
+    passed without a task finishing, is capped at max_wait, and is jittered
+    so that many wrappers started together do not poll in lock step.
+
+    Args:
+        attempt: int, number of checks since a task last finished.
+        wait: float, the interval used right after the tasks are started.
+        max_wait: float, the longest interval to return.
+
+    Returns:
+        float: the number of seconds to wait.
+    """
+    if attempt == 0:
+        return wait
+    delay = min(max_wait, max(wait, MIN_WAIT) * BACKOFF_FACTOR ** attempt)
+    return delay * random.uniform(1 - JITTER, 1)
+
+
+def monitor(started, wait, on_finish, max_wait=DEFAULT_MAX_WAIT,
+            expected=None, queued=(), start=None, started_at=None,
+            window=DEFAULT_WINDOW, statuses=None):
+    """ Waits for EE tasks to finish, starting queued tasks as it goes.
+
+    A single loop tracks every task, the states of all the unfinished tasks
+    are refreshed together. Checks start wait seconds apart and back off
+    while nothing finishes, see backoff. If the runtime of a task is known
+    from an earlier run, a check is also scheduled for when it is expected
+    to finish.
+
+    Tasks that could not be started right away (e.g. because the workflow is
+    already running as many tasks as it may, see geemake.quota) are passed in
+    queued, start is called with each of them, in order, until it succeeds.
+    queued is consumed lazily and at most window tasks are unfinished at
+    once, so it can be a generator of any length.
+
+    Args:
+        started: dict mapping the id of each started task to a value that is
+            passed to on_finish when that task finishes.
+        wait: float, seconds to wait before first checking the task states.
+        on_finish: callable, called as on_finish(value, state, runtime) once
+            for each task when it leaves the READY and RUNNING states, where
+            runtime is the number of seconds since the task was started.
+        max_wait: float, the longest time to wait between checks.
+        expected: dict mapping values to the expected runtime in seconds of
+            the task they belong to, it may be filled in as queued is
+            consumed.
+        queued: iterable of values of tasks that have not been started.
+        start: callable, start(value) starts the task of a queued value and
+            returns its id, or returns None if it cannot be started yet.
+        started_at: dict mapping task ids to the epoch time the task was
+            started, for tasks started before they were passed to monitor,
+            e.g. by an earlier run, defaults to now.
+        window: int, the most tasks to have started and not finished at
+            once, None for no limit.
+        statuses: dict, if given the final status of each task, see
+            get_task_statuses, is stored in it under the task's value before
+            on_finish is called.
+
+    Returns:
+        None
+    """
+    expected = {} if expected is None else expected
+    known = started_at or {}
+    now = time.time()
+    pending = dict(started)
+    started_at = {x: known.get(x, now) for x in pending}
+    queued = iter(queued)
+    waiting = next(queued, _DONE)
+    attempt = 0
+    while True:
+        blocked = False
+        while waiting is not _DONE and (window is None or
+                                        len(pending) < window):
+            task_id = start(waiting)
+            if task_id is None:
+                blocked = True
+                break
+            pending[task_id] = waiting
+            started_at[task_id] = known.get(task_id, time.time())
+            waiting = next(queued, _DONE)
+        if not pending and waiting is _DONE:
+            return
+
+        delay = backoff(attempt, wait, max_wait)
+        if blocked:
+            delay = min(delay, QUEUE_WAIT)
+        now = time.time()
+        upcoming = [
+            started_at[x] + expected[v] - now for x, v in pending.items()
+            if started_at[x] + expected.get(v, 0) > now
+        ]
+        if upcoming:
+            delay = min(delay, max(MIN_WAIT, min(upcoming)))
+        time.sleep(delay)
+
+        attempt += 1
+        if not pending:
+            continue
+        for task_id, status in get_task_statuses(pending.keys()).items():
+            if status['state'] in ACTIVE_STATES:
+                continue
+            runtime = time.time() - started_at.pop(task_id)
+            value = pending.pop(task_id)
+            if statuses is not None:
+                statuses[value] = status
+            on_finish(value, status['state'], runtime)
+            attempt = 1
@@ -1,9 +1,40 @@
+import hashlib
+import importlib.util
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 import ee
-import geemap
 
-geemap.ee_initialize()
+from geemake import cache, client
+
+DEFAULT_MAX_WORKERS = 8
+
+# lists the local files of intermediates that are never exported
+FUSED_FILE = os.path.join('.snakemake', 'geemake', 'fused.json')
+
+# the critical-path priorities of the rules, see geemake.initialize
+PRIORITIES_FILE = os.path.join('.snakemake', 'geemake', 'priorities.json')
+
+# second line of the local file of an intermediate that was not exported
+FUSED = 'fused'
+
+# types of assets that contain other assets
+CONTAINER_TYPES = ('FOLDER', 'IMAGE_COLLECTION')
+
+# where snakemake keeps the local copies of assets named with the ee://
+# storage plugin, see geemake.storage
+STORAGE_DIR = os.path.join('.snakemake', 'storage', 'ee') + os.sep
+
+# fields of an asset's metadata that describe its content, see content_of
+CONTENT_FIELDS = ('type', 'sizeBytes', 'featureCount', 'startTime', 'endTime')
+BAND_FIELDS = ('id', 'dataType', 'grid')
+
+# rule scripts that have been loaded, by path
+_modules = {}
+_modules_lock = threading.Lock()
 
 
 def epoch_time(timestamp):
@@ -22,35 +53,424 @@ def epoch_time(timestamp):
     return epoch_time
 
 
-def get_update_time(asset):
+def get_update_time(asset, use_cache=True):
     """ Returns the update time of an EE asset in epoch time.
 
+    The metadata cache is consulted first, see geemake.cache.
+
     Args:
         asset: string, path to an earth engine asset.
+        use_cache: bool, if False the cache is neither read nor written.
 
     Returns:
         float: the update time of the asset in epoch time.
     """
-    return epoch_time(ee.data.getAsset(asset)['updateTime'])
+    if use_cache:
+        update_time = cache.get(asset)
+        if update_time is not None:
+            return update_time
+    info = client.call('getAsset', asset, target=asset)
+    update_time = epoch_time(info['updateTime'])
+    if use_cache:
+        cache.put(asset, update_time)
+    return update_time
+
+
+def content_of(info):
+    """ Returns what the metadata of an EE asset says about its content.
+
+    Earth engine does not expose a checksum of an asset, its size, number of
+    features, bands and time range are used instead. Assets that are
+    exported again with the same data have the same content.
+
+    Args:
+        info: dict, the asset as returned by ee.data.getAsset.
+
+    Returns:
+        dict or None: the content of the asset, None if its size is not
+        known (e.g. for folders and image collections).
+    """
+    if 'sizeBytes' not in info:
+        return None
+    content = {k: info[k] for k in CONTENT_FIELDS if k in info}
+    if 'bands' in info:
+        content['bands'] = [
+            {k: band[k] for k in BAND_FIELDS if k in band}
+            for band in info['bands']
+        ]
+    return content
+
+
+def get_metadata(asset):
+    """ Returns the update time and the content of an EE asset.
+
+    Args:
+        asset: string, path to an earth engine asset.
+
+    Returns:
+        (float, dict or None): the update time of the asset in epoch time
+        and its content, see content_of.
+    """
+    info = client.call('getAsset', asset, target=asset)
+    return epoch_time(info['updateTime']), content_of(info)
+
+
+def storage_asset(local):
+    """ Returns the ee asset that a local copy made by the storage plugin
+    stands for.
+
+    Args:
+        local: str, path to a local file.
+
+    Returns:
+        str or None: the path to the ee asset, None if local is not under
+        STORAGE_DIR.
+    """
+    _, found, asset = local.partition(STORAGE_DIR)
+    return asset if found else None
+
+
+def split_asset(asset):
+    """ Splits an EE asset path into its parent folder and its name.
+
+    Args:
+        asset: string, path to an earth engine asset.
+
+    Returns:
+        (str, str): the path of the folder or collection that directly
+        contains asset and the last component of the path to asset.
+    """
+    folder, _, name = asset.rstrip('/').rpartition('/')
+    return folder, name
+
+
+def list_assets(folder, page_size=1000):
+    """ Returns every asset directly inside an EE folder or collection.
+
+    Pages through ee.data.listAssets so that a folder of any size costs one
+    request per page_size assets instead of one request per asset.
+
+    Args:
+        folder: string, path to an earth engine folder or collection.
+        page_size: int, number of assets to request per page.
 
+    Returns:
+        dict: mapping the name of each child asset (the last component of
+        its path) to its listing, e.g. its type and updateTime.
+    """
+    assets = {}
+    page_token = None
+    while True:
+        params = {'parent': folder, 'pageSize': page_size}
+        if page_token is not None:
+            params['pageToken'] = page_token
+        response = client.call('listAssets', params, target=folder)
+        for asset in response.get('assets', []):
+            _, name = split_asset(asset.get('id', asset.get('name', '')))
+            assets[name] = asset
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            return assets
+
+
+def list_update_times(folder, page_size=1000):
+    """ Returns the update times of every asset directly inside an EE folder.
+
+    Args:
+        folder: string, path to an earth engine folder or collection.
+        page_size: int, number of assets to request per page.
+
+    Returns:
+        dict: mapping the name of each child asset (the last component of
+        its path) to its update time in epoch time.
+    """
+    return {
+        name: epoch_time(asset['updateTime'])
+        for name, asset in list_assets(folder, page_size).items()
+    }
+
+
+def _try_get_update_time(asset):
+    # only a missing asset is reported as missing, any other error (which
+    # the client has already retried) is raised rather than mistaken for it
+    try:
+        return get_update_time(asset, use_cache=False)
+    except ee.EEException as e:
+        if is_not_found(e):
+            return None
+        raise
+
+
+def _try_list_update_times(folder):
+    try:
+        return list_update_times(folder)
+    except ee.EEException:
+        return None
+
+
+def get_update_times(assets, ee_prefix=None, max_workers=DEFAULT_MAX_WORKERS):
+    """ Returns the update times of many EE assets using folder listings.
+
+    The parent folders of all the assets that fall under ee_prefix are each
+    listed once, all other assets (or assets whose folder could not be
+    listed) fall back to one ee.data.getAsset call each. The remote calls
+    are spread over a pool of max_workers threads. Assets found in the
+    metadata cache are not requested at all and every fetched update time is
+    written back to the cache.
+
+    Args:
+        assets: iterable of strings, paths to earth engine assets.
+        ee_prefix: string, only folders under this prefix are listed, if None
+            every parent folder is listed.
+        max_workers: int, maximum number of concurrent requests to make.
+
+    Returns:
+        dict: mapping each asset to its update time in epoch time, or to None
+        if the asset does not exist.
+    """
+    assets = set(assets)
+    update_times = cache.get_many(assets)
+    folders = {}
+    remaining = []
+    for asset in assets - update_times.keys():
+        folder, _ = split_asset(asset)
+        if ee_prefix is None or (folder + '/').startswith(ee_prefix):
+            folders.setdefault(folder, []).append(asset)
+        else:
+            remaining.append(asset)
+
+    fetched = {}
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        listings = executor.map(_try_list_update_times, folders.keys())
+        for children, listing in zip(folders.values(), listings):
+            if listing is None:
+                remaining.extend(children)
+                continue
+            for asset in children:
+                fetched[asset] = listing.get(split_asset(asset)[1])
+
+        results = executor.map(_try_get_update_time, remaining)
+        fetched.update(zip(remaining, results))
+
+    cache.put_many(fetched)
+    update_times.update(fetched)
+    return update_times
+
+
+def is_not_found(error):
+    """ Returns True if an ee.EEException says an asset does not exist. """
+    message = str(error).lower()
+    return 'does not exist' in message or 'not found' in message
+
+
+def _try_list_assets(folder):
+    try:
+        return list_assets(folder)
+    except ee.EEException as e:
+        if is_not_found(e):
+            return {}
+        raise
+
+
+def _try_delete_asset(asset):
+    try:
+        client.call('deleteAsset', asset, target=asset)
+    except ee.EEException as e:
+        if is_not_found(e):
+            return False
+        raise
+    return True
+
+
+def _delete_or_list(asset):
+    """ Deletes an asset, or lists its children if it is a folder or
+    collection that cannot be deleted because it is not empty.
+
+    Returns:
+        (bool, list of str or None): whether the asset was deleted and the
+        paths of its children, None unless it is a container.
+    """
+    try:
+        return _try_delete_asset(asset), None
+    except ee.EEException as e:
+        error = e
+    try:
+        info = client.call('getAsset', asset, target=asset)
+    except ee.EEException as e:
+        if is_not_found(e):
+            return False, None
+        raise
+    if info.get('type') not in CONTAINER_TYPES:
+        raise error
+    return False, [f'{asset}/{name}' for name in _try_list_assets(asset)]
+
+
+def delete_assets(assets, max_workers=DEFAULT_MAX_WORKERS):
+    """ Deletes EE assets, including everything inside folders and
+    collections.
+
+    Each asset is deleted directly, assets that do not exist are skipped.
+    Only folders and collections that cannot be deleted because they are
+    not empty are listed, their children are deleted first and then they
+    are deleted again. The requests of each level of the tree are made
+    concurrently.
+
+    Args:
+        assets: iterable of strings, paths to earth engine assets.
+        max_workers: int, maximum number of concurrent requests to make.
+
+    Returns:
+        list of str: the paths of the assets that were deleted, children
+        included.
+
+    Raises:
+        ee.EEException: if an existing asset could not be deleted.
+    """
+    level = sorted(set(assets))
+    deleted = []
+    # the folders and collections of each level, deleted once empty
+    containers = []
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while level:
+            results = list(pool.map(_delete_or_list, level))
+            deleted.extend(x for x, (ok, _) in zip(level, results) if ok)
+            containers.append([
+                x for x, (_, children) in zip(level, results)
+                if children is not None
+            ])
+            level = [
+                child for _, children in results for child in children or ()
+            ]
+        for level in reversed(containers):
+            results = pool.map(_try_delete_asset, level)
+            deleted.extend(x for x, ok in zip(level, results) if ok)
+    return deleted
 
-def write_update_time(asset, local):
+
+def read_update_time(local):
+    """ Reads the path and update time of the ee asset stored in a local file.
+
+    Args:
+        local: str, path to a local file used to track an ee asset
+
+    Returns:
+        (str, float): the path to the ee asset and the update time stored in
+        local
+    """
+    with open(local, 'r') as f:
+        lines = f.readlines()
+        return lines[0].strip(), float(lines[1].strip())
+
+
+def read_content(local):
+    """ Returns the content of the version of the ee asset that a local file
+    tracks.
+
+    Args:
+        local: str, path to a local file used to track an ee asset
+
+    Returns:
+        dict or None: the content of the asset, see content_of, None if it
+        was not recorded when local was written.
+    """
+    asset, update_time = read_update_time(local)
+    recorded, content = cache.get_contents([asset]).get(asset, (None, None))
+    return content if recorded == update_time else None
+
+
+def _serialize(x):
+    if hasattr(x, 'serialize'):
+        return x.serialize()
+    return repr(x)
+
+
+def task_fingerprint(task, inputs, ee_prefix=None):
+    """ Returns a hash of what a task computes and the assets it reads.
+
+    Two tasks with the same fingerprint produce the same asset, so a task
+    whose fingerprint matches the one that created the existing asset does
+    not need to run again. The description of the task is left out and, if
+    ee_prefix is given, so is the folder the workflow writes to, so that the
+    same workflow run under different prefixes gives the same fingerprints.
+
+    Args:
+        task: ee.batch.Task, the task, its config (including the serialized
+            computation graph) is hashed.
+        inputs: dict mapping the ee assets the task reads to what identifies
+            their content, their update time in epoch time or the
+            fingerprint of the task that created them.
+        ee_prefix: str, the folder that the workflow writes to.
+
+    Returns:
+        str: a hex digest.
+    """
+    config = {k: v for k, v in task.config.items() if k != 'description'}
+    definition = json.dumps(
+        {'config': config, 'inputs': inputs},
+        sort_keys=True,
+        default=_serialize,
+    )
+    if ee_prefix:
+        definition = definition.replace(ee_prefix, '<ee_prefix>')
+    return hashlib.sha256(definition.encode()).hexdigest()
+
+
+def write_update_time(asset, local, update_time=None, content=None):
     """ Writes the path and update time of the ee asset to local file.
 
+    The content of the asset is recorded in the metadata cache rather than in
+    local, so that local holds the same bytes however it was written and
+    snakemake can tell it has not changed.
+
     Does nothing if the asset does not exist.
 
     Args:
         asset: str, path to an ee asset
         local: str, path to a local file used to track the ee asset
+        update_time: float, the update time of asset in epoch time, if None
+            it is fetched from earth engine, along with the content of the
+            asset, and stored in the cache
+        content: dict, the content of asset, see content_of
 
     Returns:
-        None
+        float: the update time written to local
     """
-    update_time = get_update_time(asset)
+    if update_time is None:
+        update_time, content = get_metadata(asset)
+        cache.put(asset, update_time)
+    if content is not None:
+        cache.put_content(asset, update_time, content)
     with open(local, 'w') as f:
         f.write(asset)
         f.write('\n')
         f.write(str(update_time))
+    return update_time
+
+
+def refresh_update_time(asset, local):
+    """ Rewrites local file for a new version of the ee asset, keeping the
+    modification time of local if the content of the asset has not changed.
+
+    Snakemake only reruns the rules that read local if it is newer than
+    their outputs, so rewriting an asset with the same data does not make
+    the rest of the workflow out of date.
+
+    Args:
+        asset: str, path to an ee asset
+        local: str, path to a local file used to track the ee asset
+
+    Returns:
+        bool: True if the content of the asset changed.
+    """
+    previous = read_content(local)
+    stat = os.stat(local)
+    update_time, content = get_metadata(asset)
+    cache.put(asset, update_time)
+    write_update_time(asset, local, update_time, content)
+    if previous is None or previous != content:
+        return True
+    os.utime(local, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    return False
 
 
 def check_update_time(local):
@@ -63,11 +483,117 @@ def check_update_time(local):
         asset:, str, path to the corresponding ee asset if local needs to be
         updated or None if the updateTime of the local file matches the asset
     """
+    asset, local_update_time = read_update_time(local)
+    true_update_time = get_update_time(asset)
+
+    if local_update_time != true_update_time:
+        return asset
+
+
+def write_fused(files):
+    """ Records which local files stand for intermediates that are never
+    exported, see geemake.initialize.
+
+    Args:
+        files: iterable of str, paths to local files.
+
+    Returns:
+        None
+    """
+    os.makedirs(os.path.dirname(FUSED_FILE), exist_ok=True)
+    with open(FUSED_FILE, 'w') as f:
+        json.dump(sorted(files), f)
+
+
+def read_fused():
+    """ Returns the set of local files recorded by write_fused. """
+    try:
+        with open(FUSED_FILE) as f:
+            return set(json.load(f))
+    except FileNotFoundError:
+        return set()
+
+
+def write_priorities(priorities):
+    """ Records the priority of each rule, see geemake.initialize.
+
+    Args:
+        priorities: dict mapping rule names to ints.
+
+    Returns:
+        None
+    """
+    os.makedirs(os.path.dirname(PRIORITIES_FILE), exist_ok=True)
+    with open(PRIORITIES_FILE, 'w') as f:
+        json.dump(priorities, f, sort_keys=True)
+
+
+def read_priorities():
+    """ Returns the priorities recorded by write_priorities. """
+    try:
+        with open(PRIORITIES_FILE) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def write_recipe(asset, local, recipe):
+    """ Writes how to compute an ee asset that is not exported to local file.
+
+    Args:
+        asset: str, path to the ee asset that local stands for.
+        local: str, path to a local file used to track the ee asset.
+        recipe: dict, the script, inputs and outputs of the rule that
+            computes asset, see wrapper.py.
+
+    Returns:
+        None
+    """
+    with open(local, 'w') as f:
+        f.write(asset)
+        f.write('\n')
+        f.write(FUSED)
+        f.write('\n')
+        f.write(json.dumps(recipe))
+
+
+def read_recipe(local):
+    """ Reads the recipe written by write_recipe.
+
+    Args:
+        local: str, path to a local file used to track an ee asset.
+
+    Returns:
+        dict or None: the recipe, None if local tracks an existing asset.
+    """
     with open(local, 'r') as f:
         lines = f.readlines()
-        asset = lines[0].strip()
-        local_update_time = float(lines[1].strip())
-        true_update_time = get_update_time(asset)
+    if len(lines) < 3 or lines[1].strip() != FUSED:
+        return None
+    return json.loads(lines[2])
+
+
+def load_create_tasks(path):
+    """ Loads the create_tasks function from a rule script.
 
-        if local_update_time != true_update_time:
-            return asset
+    Scripts are loaded once per process and again only if they change. The
+    daemon (see geemake.daemon) loads the script of a job before forking the
+    process that runs it, which then finds the script already loaded.
+
+    Args:
+        path: str, path to the rule script.
+
+    Returns:
+        callable: the create_tasks function defined in the script.
+    """
+    path = os.path.realpath(path)
+    modified = os.path.getmtime(path)
+    with _modules_lock:
+        if path not in _modules or _modules[path][0] != modified:
+            # adapted from:
+            # https://docs.python.org/3/library/importlib.html#importing-a-source-file-directly
+            spec = importlib.util.spec_from_file_location('geemake_rule', path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            _modules[path] = (modified, module)
+        return _modules[path][1].create_tasks
@@ -0,0 +1,10 @@
+""" Registers geemake's earth engine storage plugin with Snakemake, see
+geemake.storage.
+"""
+from geemake.storage import (
+    StorageObject,
+    StorageProvider,
+    StorageProviderSettings,
+)
+
+__all__ = ['StorageObject', 'StorageProvider', 'StorageProviderSettings']
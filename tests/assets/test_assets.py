@@ -0,0 +1,80 @@
+import pytest
+
+import ee
+
+from geemake import cache, fake, utils
+
+EE_PREFIX = 'users/geemake/fake-tests/'
+
+pytestmark = pytest.mark.usefixtures('fake_ee')
+
+
+def test_get_update_times_lists_each_folder_once():
+    assets = [EE_PREFIX + f'asset-{i}' for i in range(20)]
+    for asset in assets:
+        fake.create_asset(asset)
+
+    update_times = utils.get_update_times(
+        assets + [EE_PREFIX + 'missing'], EE_PREFIX
+    )
+
+    assert all(update_times[x] is not None for x in assets)
+    assert update_times[EE_PREFIX + 'missing'] is None
+    assert fake.call_counts() == {'listAssets': 1}
+
+
+def test_get_update_times_uses_cache():
+    fake.create_asset(EE_PREFIX + 'a', update_time=1000.0)
+    cache.configure({'ee_cache_ttl': 60})
+
+    utils.get_update_times([EE_PREFIX + 'a'], EE_PREFIX)
+    update_times = utils.get_update_times([EE_PREFIX + 'a'], EE_PREFIX)
+
+    cache.configure({})
+    assert update_times == {EE_PREFIX + 'a': 1000.0}
+    assert fake.call_counts() == {'listAssets': 1}
+
+
+def test_delete_assets_deletes_collections_and_folders():
+    fake.create_asset(EE_PREFIX + 'table')
+    fake.create_asset(EE_PREFIX + 'collection', 'IMAGE_COLLECTION')
+    for i in range(3):
+        fake.create_asset(EE_PREFIX + f'collection/image-{i}', 'IMAGE')
+    fake.create_asset(EE_PREFIX + 'folder/nested/table')
+    fake.create_asset(EE_PREFIX + 'kept')
+
+    with pytest.raises(ee.EEException):
+        ee.data.deleteAsset(EE_PREFIX + 'collection')
+
+    deleted = utils.delete_assets([
+        EE_PREFIX + 'table', EE_PREFIX + 'collection', EE_PREFIX + 'folder',
+        EE_PREFIX + 'missing',
+    ])
+
+    assert sorted(deleted) == sorted([
+        EE_PREFIX + 'table', EE_PREFIX + 'collection',
+        *[EE_PREFIX + f'collection/image-{i}' for i in range(3)],
+        EE_PREFIX + 'folder/nested/table',
+    ])
+    assert list(utils.list_assets(EE_PREFIX.rstrip('/'))) == ['kept']
+
+
+def test_delete_assets_only_lists_containers_that_are_not_empty():
+    for i in range(20):
+        fake.create_asset(EE_PREFIX + f'table-{i}')
+    fake.create_asset(EE_PREFIX + 'collection', 'IMAGE_COLLECTION')
+    fake.create_asset(EE_PREFIX + 'collection/image', 'IMAGE')
+
+    deleted = utils.delete_assets([
+        EE_PREFIX + 'table-0', EE_PREFIX + 'collection', EE_PREFIX + 'missing',
+    ])
+
+    assert sorted(deleted) == [
+        EE_PREFIX + 'collection', EE_PREFIX + 'collection/image',
+        EE_PREFIX + 'table-0',
+    ]
+    # the folder holding the assets is never listed, the collection is
+    # listed once its deletion fails
+    assert fake.call_counts() == {
+        'deleteAsset': 5, 'getAsset': 1, 'listAssets': 1,
+    }
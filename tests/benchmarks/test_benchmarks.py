@@ -0,0 +1,51 @@
+import pytest
+
+import ee
+
+from geemake import benchmarks, tasks
+
+EE_PREFIX = 'users/geemake/fake-tests/'
+
+pytestmark = pytest.mark.usefixtures('fake_ee')
+
+
+def test_monitor_records_task_usage_for_benchmarks(tmp_path):
+    task = ee.batch.Export.table.toAsset(
+        collection=ee.FeatureCollection(EE_PREFIX + 'input'),
+        assetId=EE_PREFIX + 'output',
+    )
+    task.start()
+    statuses = {}
+
+    def on_finish(asset, state, runtime):
+        benchmarks.record('export', asset, statuses[asset], runtime, 100,
+                          extra=str(tmp_path / 'benchmark.tsv'))
+
+    tasks.monitor({task.id: EE_PREFIX + 'output'}, 0, on_finish,
+                  max_wait=0.5, statuses=statuses)
+
+    rows = benchmarks.read(benchmarks.path('export'))
+    assert rows == benchmarks.read(tmp_path / 'benchmark.tsv')
+    [row] = rows
+    assert (row['asset'], row['task_id'], row['state']) == \
+        (EE_PREFIX + 'output', task.id, 'COMPLETED')
+    assert row['eecu_seconds'] == pytest.approx(0.5, abs=0.01)
+    assert row['queue_wait'] == 0
+    assert row['run_time'] > 0 and row['wall_time'] > 0
+    assert row['size_bytes'] == 100
+
+
+def test_concurrent_benchmark_rows_share_one_header():
+    from concurrent.futures import ThreadPoolExecutor
+
+    status = {'id': 'TASK', 'state': 'COMPLETED'}
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(
+            lambda i: benchmarks.record('rule', f'asset-{i}', status, 1.0),
+            range(64),
+        ))
+
+    with open(benchmarks.path('rule')) as f:
+        lines = f.read().splitlines()
+    assert lines.count(lines[0]) == 1 and lines[0].startswith('time\t')
+    assert len(benchmarks.read(benchmarks.path('rule'))) == 64
@@ -0,0 +1,84 @@
+import time
+
+import pytest
+
+import ee
+
+from geemake import client, fake, ratelimit, utils
+
+EE_PREFIX = 'users/geemake/fake-tests/'
+
+pytestmark = pytest.mark.usefixtures('fake_ee')
+
+
+def test_client_traces_requests():
+    fake.create_asset(EE_PREFIX + 'a')
+    client.configure({'ee_trace': True}, rule='test')
+    client.start_run()
+
+    utils.get_update_time(EE_PREFIX + 'a', use_cache=False)
+    with pytest.raises(ee.EEException):
+        client.call('deleteAsset', EE_PREFIX + 'b', target=EE_PREFIX + 'b')
+    client.flush()
+    records = client.read_trace()
+    client.configure({})
+
+    assert [x['operation'] for x in records] == ['getAsset', 'deleteAsset']
+    assert all(x['rule'] == 'test' for x in records)
+    assert records[1]['error'] == 'EEException'
+
+    summary = client.summarize(records)
+    assert summary['deleteAsset']['errors'] == 1
+    assert 'geemake_ee_requests_total{operation="getAsset",rule="test"} 1' \
+        in client.prometheus_text(records)
+
+
+def test_client_retries_transient_errors(tmp_path):
+    assets = [EE_PREFIX + f'asset-{i}' for i in range(10)]
+    for asset in assets:
+        fake.create_asset(asset, update_time=1000.0)
+    fake.configure({'path': str(tmp_path / 'fake-ee.sqlite'),
+                    'failure_rate': 0.5, 'seed': 0})
+    client.configure({'ee_trace': True, 'ee_retry_wait': 0.01,
+                      'ee_max_retries': 20})
+    client.start_run()
+
+    update_times = {x: utils.get_update_time(x, use_cache=False)
+                    for x in assets}
+    client.flush()
+    records = client.read_trace()
+    client.configure({})
+
+    assert update_times == {x: 1000.0 for x in assets}
+    assert any(x['retries'] for x in records)
+    assert not any(x['error'] for x in records)
+
+
+def test_client_does_not_retry_missing_assets():
+    client.configure({'ee_trace': True, 'ee_retry_wait': 0.01})
+    client.start_run()
+
+    with pytest.raises(ee.EEException):
+        client.call('getAsset', EE_PREFIX + 'missing')
+    assert utils.get_update_times([EE_PREFIX + 'missing'], EE_PREFIX) == \
+        {EE_PREFIX + 'missing': None}
+    client.flush()
+    records = client.read_trace()
+    client.configure({})
+
+    assert all(x['retries'] == 0 for x in records)
+    assert not client.is_retryable(ee.EEException(
+        'Asset "users/x/tile-500" does not exist.'
+    ))
+    assert client.is_retryable(ee.EEException('429 Too Many Requests'))
+
+
+def test_rate_limit_paces_requests():
+    ratelimit.configure({'ee_rate_limit': 20, 'ee_rate_burst': 1})
+    start = time.time()
+    waited = sum(ratelimit.acquire() for _ in range(11))
+    ratelimit.configure({})
+
+    assert time.time() - start >= 0.45
+    assert waited > 0
+    assert ratelimit.acquire() == 0.0
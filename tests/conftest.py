@@ -0,0 +1,53 @@
+import os
+import runpy
+
+import pytest
+
+from geemake import fake
+
+WRAPPER = os.path.join(
+    os.path.dirname(__file__), '..', 'geemake', 'wrapper.py'
+)
+
+EXPORT_SCRIPT = """
+import ee
+
+
+def create_tasks(inputs, outputs):
+    return [(outputs[0], ee.batch.Export.table.toAsset(
+        collection=ee.FeatureCollection(inputs[0]), assetId=outputs[0],
+    ))]
+"""
+
+
+@pytest.fixture
+def fake_ee(tmp_path, monkeypatch):
+    """ Runs a test in an empty directory against a fresh fake backend. """
+    monkeypatch.chdir(tmp_path)
+    options = {'path': str(tmp_path / 'fake-ee.sqlite'), 'task_duration': 0.5}
+    with fake.backend(options):
+        yield
+
+
+@pytest.fixture
+def run_wrapper():
+    """ Returns a function that runs wrapper.py in this process for a job.
+
+    The job's rule script is written to <rule>.py, by default one that
+    exports the rule's first input to its first output.
+    """
+    from snakemake.io import InputFiles, Log, OutputFiles, Params, Resources
+    from snakemake.script import Snakemake
+
+    def run(rule, inputs, outputs, config, script=EXPORT_SCRIPT):
+        with open(f'{rule}.py', 'w') as f:
+            f.write(script)
+        params = Params(toclone=[f'{rule}.py', 0, 0.5])
+        for i, name in enumerate(('script', 'wait', 'max_wait')):
+            params._set_name(name, i)
+        job = Snakemake(
+            InputFiles(toclone=inputs), OutputFiles(toclone=outputs),
+            params, Params(), 1, Resources(), Log(), config, rule, None,
+        )
+        runpy.run_path(WRAPPER, {'snakemake': job}, '__main__')
+    return run
@@ -0,0 +1,117 @@
+import os
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import ee
+
+from geemake import daemon, fake, quota, utils
+
+EE_PREFIX = 'users/geemake/fake-tests/'
+
+pytestmark = pytest.mark.usefixtures('fake_ee')
+
+
+def test_daemon_runs_jobs(tmp_path, capsys):
+    wrapper = tmp_path / 'wrapper.py'
+    wrapper.write_text(
+        'print("ran", snakemake.rule)\n'
+        'if snakemake.rule == "bad":\n'
+        '    raise ValueError("bad rule")\n'
+    )
+    assert not daemon.submit(str(wrapper), SimpleNamespace(rule='good'))
+
+    daemon.start(idle=2)
+    assert daemon.submit(str(wrapper), SimpleNamespace(rule='good'))
+    assert capsys.readouterr().out == 'ran good\n'
+    with pytest.raises(RuntimeError, match='bad rule'):
+        daemon.submit(str(wrapper), SimpleNamespace(rule='bad'))
+    # jobs that cannot be sent as JSON are run by the wrapper itself
+    assert not daemon.submit(str(wrapper), SimpleNamespace(
+        rule='good', config={'callback': print},
+    ))
+    # and so are the jobs of wrappers that are not local files
+    assert not daemon.submit(
+        'https://example.com/geemake/wrapper.py', SimpleNamespace(rule='good')
+    )
+
+
+def test_daemon_jobs_do_not_share_settings(tmp_path, capsys):
+    from concurrent.futures import ThreadPoolExecutor
+
+    from snakemake.io import InputFiles, Params
+
+    wrapper = tmp_path / 'wrapper.py'
+    wrapper.write_text(
+        'import time\n'
+        'from geemake import quota\n'
+        'quota.configure(snakemake.config)\n'
+        'time.sleep(0.5)\n'
+        'print(snakemake.rule, snakemake.input.table,\n'
+        '      snakemake.params.get("script"), quota._settings["limit"])\n'
+    )
+
+    def job(i):
+        inputs = InputFiles(toclone=[f'.local/in-{i}'])
+        inputs._set_name('table', 0)
+        params = Params(toclone=[f'script-{i}.py'])
+        params._set_name('script', 0)
+        return SimpleNamespace(rule=f'rule-{i}', input=inputs, params=params,
+                               config={'ee_max_tasks': i})
+
+    daemon.start(idle=2)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        assert all(executor.map(
+            lambda i: daemon.submit(str(wrapper), job(i)), (1, 2)
+        ))
+    assert sorted(capsys.readouterr().out.splitlines()) == [
+        'rule-1 .local/in-1 script-1.py 1',
+        'rule-2 .local/in-2 script-2.py 2',
+    ]
+
+
+def test_daemon_prepares_jobs_before_forking(tmp_path, capsys):
+    from snakemake.io import Params
+
+    wrapper = tmp_path / 'wrapper.py'
+    wrapper.write_text(
+        'from geemake import session, utils\n'
+        'print(session.is_initialized(), list(utils._modules))\n'
+    )
+    script = tmp_path / 'script.py'
+    script.write_text('def create_tasks(inputs, outputs):\n    return []\n')
+    params = Params(toclone=[str(script)])
+    params._set_name('script', 0)
+    config = {'ee_fake': {'path': str(tmp_path / 'fake-ee.sqlite')}}
+
+    daemon.start(idle=2)
+    assert daemon.submit(str(wrapper), SimpleNamespace(
+        rule='rule', params=params, config=config,
+    ))
+    # the process forked for the job inherits what the daemon prepared
+    assert capsys.readouterr().out == \
+        f'True {[os.path.realpath(script)]}\n'
+
+
+def test_daemon_runs_the_wrapper(tmp_path, capsys, run_wrapper):
+    config = {
+        'ee_prefix': EE_PREFIX, 'local_prefix': '.local/', 'ee_daemon': True,
+        # the daemon uses the same fake backend as the test
+        'ee_fake': {'path': str(tmp_path / 'fake-ee.sqlite'),
+                    'task_duration': 0.5},
+    }
+    fake.create_asset(EE_PREFIX + 'input')
+    os.makedirs('.local')
+    utils.write_update_time(EE_PREFIX + 'input', '.local/input')
+
+    daemon.start(idle=2)
+    # the wrapper exits once the daemon has run the job
+    with pytest.raises(SystemExit):
+        run_wrapper('export', ['.local/input'], ['.local/output'], config)
+    assert capsys.readouterr().out == \
+        'export: 1 of 1 started tasks finished, 0 of them failed\n'
+    assert [x['state'] for x in ee.data.getTaskList()] == ['COMPLETED']
+    assert utils.read_update_time('.local/output') == (
+        EE_PREFIX + 'output', utils.get_update_time(EE_PREFIX + 'output'),
+    )
@@ -0,0 +1,35 @@
+import pytest
+
+import ee
+
+from geemake import fake, utils
+
+EE_PREFIX = 'users/geemake/fake-tests/'
+
+pytestmark = pytest.mark.usefixtures('fake_ee')
+
+
+def test_get_asset_and_delete_asset():
+    fake.create_asset(EE_PREFIX + 'a', update_time=1000.0)
+
+    assert utils.get_update_time(EE_PREFIX + 'a') == 1000.0
+
+    ee.data.deleteAsset(EE_PREFIX + 'a')
+    with pytest.raises(ee.EEException):
+        ee.data.getAsset(EE_PREFIX + 'a')
+
+
+def test_list_assets_pages_through_direct_children():
+    for i in range(5):
+        fake.create_asset(EE_PREFIX + f'asset-{i}', update_time=float(i))
+    fake.create_asset(EE_PREFIX + 'folder/nested')
+
+    response = ee.data.listAssets({'parent': EE_PREFIX, 'pageSize': 4})
+    assert len(response['assets']) == 4
+    assert 'nextPageToken' in response
+
+    update_times = utils.list_update_times(EE_PREFIX.rstrip('/'), 2)
+    assert update_times == {
+        **{f'asset-{i}': float(i) for i in range(5)},
+        'folder': update_times['folder'],
+    }
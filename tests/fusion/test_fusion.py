@@ -0,0 +1,80 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+from snakemake.io import temp
+
+import ee
+
+from geemake import fake, geemake, utils
+
+EE_PREFIX = 'users/geemake/fake-tests/'
+
+pytestmark = pytest.mark.usefixtures('fake_ee')
+
+
+def test_only_temporary_outputs_read_by_ee_rules_are_fused():
+    def rule(inputs, outputs):
+        return SimpleNamespace(input=inputs, output=outputs)
+
+    rules = [
+        rule(['.local/a'], [temp('.local/b')]),
+        rule(['.local/b'], [temp('.local/c'), '.local/d']),
+        rule(['.local/c'], ['.local/e']),
+        rule(['.local/d', '.local/e'], [temp('.local/f')]),
+        rule(['.local/f'], ['report.csv']),
+    ]
+    consumers = {}
+    for x in rules:
+        for file in x.input:
+            consumers.setdefault(file, []).append(x)
+
+    assert geemake._fusable(rules, consumers, '.local/') == {
+        '.local/b', '.local/c',
+    }
+
+
+def test_fused_chains_run_through_the_wrapper(run_wrapper):
+    config = {'ee_prefix': EE_PREFIX, 'local_prefix': '.local/'}
+    rules = [
+        SimpleNamespace(name='subset', input=['.local/cities'],
+                        output=[temp('.local/subset')]),
+        SimpleNamespace(name='buffer', input=['.local/subset'],
+                        output=['.local/buffer']),
+    ]
+    fake.create_asset(EE_PREFIX + 'cities')
+
+    def exported(name):
+        return utils.get_update_times([EE_PREFIX + name])[EE_PREFIX + name] \
+            is not None
+
+    def run():
+        geemake.initialize(rules, config, targets=[])
+        for rule in rules:
+            if not os.path.isfile(rule.output[0]):
+                run_wrapper(rule.name, rule.input, rule.output, config)
+
+    # the intermediate is not exported, its consumer exports both rules'
+    # computation at once
+    run()
+    assert utils.read_recipe('.local/subset')['script'] == 'subset.py'
+    assert [x['description'] for x in ee.data.getTaskList()] == \
+        ['myExportTableTask']
+    assert not exported('subset')
+    assert exported('buffer')
+
+    # with fusion turned off the intermediate is exported when it is needed
+    # again, rather than its recipe being read as an asset
+    config['ee_fuse'] = False
+    os.remove('.local/buffer')
+    run()
+    assert utils.read_recipe('.local/subset') is None
+    assert len(ee.data.getTaskList()) == 3
+    assert exported('subset')
+
+    # and with fusion turned back on the exported intermediate is read as is
+    config['ee_fuse'] = True
+    os.remove('.local/buffer')
+    run()
+    assert utils.read_update_time('.local/subset')[0] == EE_PREFIX + 'subset'
+    assert len(ee.data.getTaskList()) == 4
@@ -0,0 +1,14 @@
+import os
+import subprocess
+import sys
+
+
+def test_importing_geemake_does_not_import_ee():
+    # in a new interpreter, as the tests themselves import ee
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    result = subprocess.run(
+        [sys.executable, '-c',
+         'import sys, geemake.geemake; print("ee" in sys.modules)'],
+        env=env, capture_output=True, text=True, check=True,
+    )
+    assert result.stdout == 'False\n'
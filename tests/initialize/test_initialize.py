@@ -0,0 +1,171 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+
+import ee
+
+from geemake import fake, geemake, quota, tasks, utils
+
+EE_PREFIX = 'users/geemake/fake-tests/'
+
+pytestmark = pytest.mark.usefixtures('fake_ee')
+
+
+def test_initialize_only_checks_inputs_of_requested_targets():
+    config = {'ee_prefix': EE_PREFIX, 'local_prefix': '.local/'}
+    rules = [
+        SimpleNamespace(name='a', input=['.local/in-a'], output=['.local/a']),
+        SimpleNamespace(name='b', input=['.local/a'], output=['.local/b']),
+        SimpleNamespace(name='c', input=['.local/in-c'], output=['.local/c']),
+    ]
+    fake.create_asset(EE_PREFIX + 'in-a')
+    fake.create_asset(EE_PREFIX + 'in-c')
+    fake.create_asset(EE_PREFIX + 'a')
+
+    assert geemake._requested(rules, ['.local/b']) == rules[:2]
+    assert geemake._requested(rules, ['c']) == rules[2:]
+    assert geemake._requested(rules, ['.local/{x}']) == rules
+
+    geemake.initialize(rules, config, targets=['b'])
+    assert os.path.exists('.local/in-a')
+    assert os.path.exists('.local/a')
+    assert not os.path.exists('.local/in-c')
+
+    # the outputs of the targets are refreshed too
+    os.remove('.local/a')
+    geemake.initialize(rules, config, targets=['a'])
+    assert os.path.exists('.local/a')
+
+
+def test_initialize_prioritizes_rules_on_the_longest_chains():
+    config = {'ee_prefix': EE_PREFIX, 'local_prefix': '.local/'}
+
+    def rule(name, inputs, outputs, priority=0):
+        return SimpleNamespace(name=name, input=inputs, output=outputs,
+                               priority=priority)
+
+    # a chain subset -> buffer -> intersect next to a wide leaf rule
+    rules = [
+        rule('subset', ['.local/cities'], ['.local/subset']),
+        rule('buffer', ['.local/subset'], ['.local/buffer']),
+        rule('intersect', ['.local/buffer', '.local/parks'],
+             ['.local/intersect']),
+        rule('fan_out', ['.local/cities'], ['.local/tile-{i}']),
+        rule('report', ['.local/subset'], ['report.csv'], priority=50),
+    ]
+    fake.create_asset(EE_PREFIX + 'cities')
+    fake.create_asset(EE_PREFIX + 'parks')
+
+    geemake.initialize(rules, config, targets=[])
+
+    expected = {'subset': 3, 'buffer': 2, 'intersect': 1, 'fan_out': 1,
+                'report': 1}
+    assert utils.read_priorities() == expected
+    assert [x.priority for x in rules] == [3, 2, 1, 1, 50]
+    assert tasks.task_priority(3) == 102
+    assert tasks.task_priority(0) == tasks.DEFAULT_PRIORITY
+    assert tasks.task_priority(10 ** 6) == tasks.MAX_PRIORITY
+
+    # the wrappers queue for task slots by the priority of their rule, the
+    # head of the chain goes first although it asked after the fan-out
+    priorities = utils.read_priorities()
+    quota.configure({'ee_max_tasks': 1})
+    fan_out = quota.enqueue(priorities['fan_out'])
+    subset = quota.enqueue(priorities['subset'])
+    assert not quota.try_acquire(fan_out)
+    assert quota.try_acquire(subset)
+    quota.configure({})
+
+    # earth engine takes the priority as a wrapped integer, as the export
+    # builders encode it, and a priority set by the rule script is kept
+    def export(name, **kwargs):
+        return ee.batch.Export.table.toAsset(
+            collection=ee.FeatureCollection(EE_PREFIX + 'cities'),
+            assetId=EE_PREFIX + name, **kwargs,
+        )
+    task = export('subset')
+    tasks.set_priority(task, priorities['subset'])
+    assert task.config['priority'] == {'value': 102}
+    task.start()
+    own = export('buffer', priority=7)
+    tasks.set_priority(own, priorities['buffer'])
+    assert own.config['priority'] == {'value': 7}
+    bare = export('intersect')
+    bare.config['priority'] = 102
+    with pytest.raises(ee.EEException, match='priority'):
+        bare.start()
+
+    # a cycle, which only wildcards can create, does not loop forever
+    loop = [rule('x', ['.local/y'], ['.local/x']),
+            rule('y', ['.local/x'], ['.local/y'])]
+    assert geemake._critical_paths(loop) == {'x': 2, 'y': 1}
+
+
+def test_initialize_keeps_local_file_of_asset_rewritten_with_same_content():
+    config = {'ee_prefix': EE_PREFIX, 'local_prefix': '.local/',
+              'ee_early_cutoff': True}
+    rules = [
+        SimpleNamespace(input=['.local/a', '.local/b'], output=['.local/c']),
+    ]
+    fake.create_asset(EE_PREFIX + 'a', update_time=1000.0, size_bytes=10)
+    fake.create_asset(EE_PREFIX + 'b', update_time=1000.0, size_bytes=10)
+    os.makedirs('.local')
+    for name in ('a', 'b'):
+        utils.write_update_time(EE_PREFIX + name, '.local/' + name)
+        os.utime('.local/' + name, (0, 0))
+    assert utils.read_content('.local/a') == \
+        {'type': 'TABLE', 'sizeBytes': '10'}
+
+    fake.create_asset(EE_PREFIX + 'a', update_time=2000.0, size_bytes=10)
+    fake.create_asset(EE_PREFIX + 'b', update_time=2000.0, size_bytes=20)
+    geemake.initialize(rules, config)
+
+    assert utils.read_update_time('.local/a')[1] == 2000.0
+    assert os.path.getmtime('.local/a') == 0
+    assert utils.read_update_time('.local/b')[1] == 2000.0
+    assert os.path.getmtime('.local/b') > 0
+
+
+def test_initialize_checks_each_asset_once_with_bounded_concurrency(
+        monkeypatch):
+    import threading
+
+    config = {'ee_prefix': EE_PREFIX, 'local_prefix': '.local/',
+              'ee_max_workers': 3}
+    # every rule reads the same table and one of its own, in its own folder
+    rules = [
+        SimpleNamespace(name=f'rule-{i}',
+                        input=['.local/shared', f'.local/folder-{i}/input'],
+                        output=[f'.local/folder-{i}/output'])
+        for i in range(12)
+    ]
+    fake.create_asset(EE_PREFIX + 'shared')
+    for i in range(12):
+        fake.create_asset(EE_PREFIX + f'folder-{i}/input')
+        os.makedirs(f'.local/folder-{i}')
+    fake.configure({**fake.options(), 'latency': 0.05})
+
+    in_flight = []
+    peak = [0]
+    lock = threading.Lock()
+    list_assets = ee.data.listAssets
+
+    def tracked(*args, **kwargs):
+        with lock:
+            in_flight.append(None)
+            peak[0] = max(peak[0], len(in_flight))
+        try:
+            return list_assets(*args, **kwargs)
+        finally:
+            with lock:
+                in_flight.pop()
+    monkeypatch.setattr(ee.data, 'listAssets', tracked)
+
+    geemake.initialize(rules, config, targets=[])
+
+    # one listing per folder, the shared table is looked up once
+    assert fake.call_counts() == {'listAssets': 13}
+    assert 1 < peak[0] <= 3
+    assert all(os.path.isfile(f'.local/folder-{i}/input') for i in range(12))
+    assert os.path.isfile('.local/shared')
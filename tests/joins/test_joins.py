@@ -0,0 +1,30 @@
+import pytest
+
+from geemake import joins
+
+EE_PREFIX = 'users/geemake/fake-tests/'
+
+pytestmark = pytest.mark.usefixtures('fake_ee')
+
+
+def test_join_matches_a_local_table_with_one_join(tmp_path):
+    pd = pytest.importorskip('pandas')
+    census = pd.DataFrame({
+        'name': [f'city-{i}' for i in range(100)],
+        'population': range(100),
+    })
+    census.to_csv(tmp_path / 'census.csv', index=False)
+
+    joined = joins.join(EE_PREFIX + 'cities', str(tmp_path / 'census.csv'),
+                        on='name')
+    graph = joined.serialize()
+
+    assert graph.count('"Join.saveFirst"') == 1
+    assert graph.count('"Filter.equals"') == 1
+    assert '"population": 99' in graph
+    assert joins.read_table(census) == \
+        joins.read_table(str(tmp_path / 'census.csv'))
+
+    task = joins.upload(census, EE_PREFIX + 'census', batch_size=30)
+    task.start()
+    assert task.config['expression'].serialize().count('"List"') == 4
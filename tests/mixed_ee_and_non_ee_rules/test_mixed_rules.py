@@ -7,14 +7,14 @@ import pandas as pd
 import pytest
 
 import ee
-import geemap
 
-geemap.ee_initialize()
+from geemake import fake, session, utils
 
-from geemake import utils
+session.initialize()
 
 LOCAL_PREFIX = '.local/'
 EE_PREFIX = 'users/boothmanrylan/geemake-tests/'
+INPUT = EE_PREFIX + 'canadian-cities'
 ASSET_1 = EE_PREFIX + 'canadian-cities-w-pop'
 ASSET_2 = EE_PREFIX + 'smallest-city'
 LOCAL_OUTPUT = 'census.csv'
@@ -25,6 +25,9 @@ LOCAL_OUTPUT = 'census.csv'
 def change_dir(request, monkeypatch):
     monkeypatch.chdir(request.fspath.dirname)
 
+    if fake.enabled():
+        fake.create_asset(INPUT)
+
     yield
 
     ee.data.deleteAsset(ASSET_1)
@@ -52,6 +55,7 @@ def get_update_times():
     return update_times
 
 
+@pytest.mark.skipif(fake.enabled(), reason='fake backend cannot compute')
 def test_run():
     subprocess.run(["snakemake", "-c1"], check=True, capture_output=True)
 
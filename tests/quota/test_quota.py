@@ -0,0 +1,37 @@
+import pytest
+
+from geemake import quota
+
+pytestmark = pytest.mark.usefixtures('fake_ee')
+
+
+def test_quota_limits_running_tasks():
+    quota.configure({'ee_max_tasks': 2})
+    first, second, third = quota.enqueue(), quota.enqueue(), quota.enqueue()
+    urgent = quota.enqueue(priority=1)
+
+    assert quota.try_acquire(urgent)
+    assert quota.try_acquire(first)
+    assert not quota.try_acquire(second)
+
+    quota.release(urgent)
+    assert not quota.try_acquire(third)  # second is ahead of third
+    assert quota.try_acquire(second)
+    quota.configure({})
+
+
+def test_quota_counts_resumed_tasks_while_slots_are_full():
+    quota.configure({'ee_max_tasks': 1})
+    running = quota.enqueue()
+    assert quota.try_acquire(running)
+    waiting = quota.enqueue(priority=1)
+
+    # a task resumed from an interrupted run holds a slot straight away
+    resumed = quota.hold()
+    assert resumed is not None
+    quota.release(running)
+    assert not quota.try_acquire(waiting)
+
+    quota.release(resumed)
+    assert quota.try_acquire(waiting)
+    quota.configure({})
@@ -0,0 +1,110 @@
+import os
+import time
+
+import pytest
+
+import ee
+
+from geemake import cache, fake, quota, utils
+
+EE_PREFIX = 'users/geemake/fake-tests/'
+
+CONFIG = {'ee_prefix': EE_PREFIX, 'local_prefix': '.local/'}
+
+EXPORT_EACH_SCRIPT = """
+import ee
+
+
+def create_tasks(inputs, outputs):
+    return [
+        (output, ee.batch.Export.table.toAsset(
+            collection=ee.FeatureCollection(input), assetId=output,
+        ))
+        for input, output in zip(inputs, outputs)
+    ]
+"""
+
+pytestmark = pytest.mark.usefixtures('fake_ee')
+
+
+def create_input(name):
+    fake.create_asset(EE_PREFIX + f'{name}-input')
+    os.makedirs('.local', exist_ok=True)
+    utils.write_update_time(
+        EE_PREFIX + f'{name}-input', f'.local/{name}-input'
+    )
+
+
+def interrupted_run(name, fingerprint=None, inputs=None):
+    """ Starts the task the wrapper would start to export name-input to
+    name-output and records it as a run that was stopped would have.
+
+    The task is fingerprinted with the inputs of the job, by default only
+    name-input.
+    """
+    create_input(name)
+    task = ee.batch.Export.table.toAsset(
+        collection=ee.FeatureCollection(EE_PREFIX + f'{name}-input'),
+        assetId=EE_PREFIX + f'{name}-output',
+    )
+    task.start()
+    if fingerprint is None:
+        fingerprint = utils.task_fingerprint(task, dict(
+            utils.read_update_time(f'.local/{x}-input')
+            for x in inputs or [name]
+        ), EE_PREFIX)
+    cache.put_submitted(EE_PREFIX + f'{name}-output', task.id, fingerprint,
+                        time.time())
+    return task.id
+
+
+def test_running_tasks_are_polled_not_submitted_again(capsys, run_wrapper):
+    task_id = interrupted_run('a')
+
+    run_wrapper('export', ['.local/a-input'], ['.local/a-output'], CONFIG)
+
+    assert f'Resuming task {task_id} creating {EE_PREFIX}a-output' in \
+        capsys.readouterr().out
+    assert [(x['id'], x['state']) for x in ee.data.getTaskList()] == \
+        [(task_id, 'COMPLETED')]
+    assert utils.read_update_time('.local/a-output')[0] == \
+        EE_PREFIX + 'a-output'
+    assert cache.get_submitted([EE_PREFIX + 'a-output']) == {}
+
+
+def test_changed_tasks_are_cancelled_and_submitted_again(capsys,
+                                                         run_wrapper):
+    task_id = interrupted_run('a', fingerprint='changed')
+
+    run_wrapper('export', ['.local/a-input'], ['.local/a-output'], CONFIG)
+
+    assert f'Cancelling task {task_id}, its definition has changed' in \
+        capsys.readouterr().out
+    tasks = ee.data.getTaskList()
+    assert [x['state'] for x in tasks] == ['COMPLETED', 'CANCELLED']
+    assert tasks[1]['id'] == task_id
+    assert os.path.isfile('.local/a-output')
+
+
+def test_resumed_tasks_count_against_the_task_limit(run_wrapper):
+    # the task of a runs long enough for the task of b to have to wait
+    options = fake.options()
+    fake.configure({**options, 'task_duration': 2})
+    create_input('b')
+    task_id = interrupted_run('a', inputs=['a', 'b'])
+    fake.configure(options)
+
+    try:
+        run_wrapper(
+            'export', ['.local/a-input', '.local/b-input'],
+            ['.local/a-output', '.local/b-output'],
+            {**CONFIG, 'ee_max_tasks': 1}, script=EXPORT_EACH_SCRIPT,
+        )
+    finally:
+        quota.configure({})
+
+    # the task of b waits for the slot of the resumed task of a
+    b, a = ee.data.getTaskList()
+    assert a['id'] == task_id
+    assert [a['state'], b['state']] == ['COMPLETED', 'COMPLETED']
+    assert b['creation_timestamp_ms'] >= a['update_timestamp_ms']
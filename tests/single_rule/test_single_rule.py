@@ -5,12 +5,12 @@ import shutil
 import pytest
 
 import ee
-import geemap
 
-geemap.ee_initialize()
+from geemake import fake, session, utils
 
-from geemake import utils
+session.initialize()
 
+INPUT = 'users/boothmanrylan/geemake-tests/canadian-cities'
 OUTPUT = 'users/boothmanrylan/geemake-tests/output'
 
 
@@ -20,6 +20,9 @@ OUTPUT = 'users/boothmanrylan/geemake-tests/output'
 def change_dir(request, monkeypatch):
     monkeypatch.chdir(request.fspath.dirname)
 
+    if fake.enabled():
+        fake.create_asset(INPUT)
+
     yield
 
     ee.data.deleteAsset(OUTPUT)
@@ -27,6 +30,7 @@ def change_dir(request, monkeypatch):
     shutil.rmtree(".snakemake")
 
 
+@pytest.mark.skipif(fake.enabled(), reason='fake backend cannot compute')
 def test_run():
     subprocess.run(["snakemake", "-c1"], check=True, capture_output=True)
 
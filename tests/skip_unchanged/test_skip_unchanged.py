@@ -0,0 +1,64 @@
+import os
+import time
+
+import pytest
+
+import ee
+
+from geemake import fake, utils
+
+EE_PREFIX = 'users/geemake/fake-tests/'
+
+CONFIG = {'ee_prefix': EE_PREFIX, 'local_prefix': '.local/',
+          'ee_skip_unchanged': True}
+
+pytestmark = pytest.mark.usefixtures('fake_ee')
+
+
+@pytest.fixture
+def rerun(run_wrapper):
+    """ Exports an input once and returns a function that runs the same job
+    again, as if its output was out of date.
+    """
+    fake.create_asset(EE_PREFIX + 'input', update_time=1000.0)
+    os.makedirs('.local')
+    utils.write_update_time(EE_PREFIX + 'input', '.local/input')
+
+    def run():
+        run_wrapper('export', ['.local/input'], ['.local/output'], CONFIG)
+    run()
+    assert len(ee.data.getTaskList()) == 1
+    os.remove('.local/output')
+    return run
+
+
+def test_unchanged_outputs_are_not_exported_again(capsys, rerun):
+    update_time = utils.get_update_time(EE_PREFIX + 'output')
+    capsys.readouterr()
+
+    rerun()
+
+    assert f'{EE_PREFIX}output is unchanged, skipping its task' in \
+        capsys.readouterr().out
+    assert len(ee.data.getTaskList()) == 1
+    assert utils.read_update_time('.local/output') == \
+        (EE_PREFIX + 'output', update_time)
+
+
+def test_changed_inputs_are_exported_again(rerun):
+    fake.create_asset(EE_PREFIX + 'input', update_time=2000.0)
+    utils.write_update_time(EE_PREFIX + 'input', '.local/input')
+
+    rerun()
+
+    assert len(ee.data.getTaskList()) == 2
+    assert os.path.isfile('.local/output')
+
+
+def test_outputs_modified_since_their_export_are_exported_again(rerun):
+    fake.create_asset(EE_PREFIX + 'output', update_time=time.time() + 60)
+
+    rerun()
+
+    assert len(ee.data.getTaskList()) == 2
+    assert utils.read_update_time('.local/output')[1] < time.time()
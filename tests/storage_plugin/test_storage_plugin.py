@@ -0,0 +1,61 @@
+from types import SimpleNamespace
+
+import pytest
+
+from geemake import fake, utils
+
+EE_PREFIX = 'users/geemake/fake-tests/'
+
+pytestmark = pytest.mark.usefixtures('fake_ee')
+
+
+def test_storage_plugin_lists_each_folder_once(tmp_path):
+    import asyncio
+    import logging
+
+    pytest.importorskip('snakemake_interface_storage_plugins')
+    from geemake import storage
+
+    assert storage.asset_id('ee://my-project/folder/a') == \
+        'projects/my-project/assets/folder/a'
+    assert storage.asset_id('ee://' + EE_PREFIX + 'a') == EE_PREFIX + 'a'
+    assert storage.StorageProvider.is_valid_query('ee://' + EE_PREFIX + 'a')
+    assert not storage.StorageProvider.is_valid_query('s3://bucket/a')
+
+    for name in ('a', 'b'):
+        fake.create_asset(EE_PREFIX + name, update_time=1000.0)
+    provider = storage.StorageProvider(
+        local_prefix=tmp_path / '.snakemake' / 'storage' / 'ee',
+        logger=logging.getLogger('test'),
+    )
+    objects = [
+        provider.object('ee://' + EE_PREFIX + name) for name in 'abc'
+    ]
+    inventory = SimpleNamespace(exists_in_storage={}, mtime={}, size={})
+    for x in objects:
+        asyncio.run(x.inventory(inventory))
+
+    assert [inventory.exists_in_storage[x.cache_key()] for x in objects] \
+        == [True, True, False]
+    assert inventory.mtime[objects[0].cache_key()].storage() == 1000.0
+    assert [x.exists() for x in objects] == [True, True, False]
+    assert fake.call_counts() == {'listAssets': 1}
+
+    objects[0].retrieve_object()
+    local = str(objects[0].local_path())
+    assert utils.storage_asset(local) == EE_PREFIX + 'a'
+    assert utils.read_update_time(local) == (EE_PREFIX + 'a', 1000.0)
+    with pytest.raises(FileNotFoundError):
+        objects[2].store_object()
+
+
+def test_storage_plugin_package_exports_the_plugin():
+    pytest.importorskip('snakemake_interface_storage_plugins')
+    import snakemake_storage_plugin_ee
+    from geemake import storage
+
+    assert snakemake_storage_plugin_ee.StorageProvider is \
+        storage.StorageProvider
+    assert snakemake_storage_plugin_ee.StorageObject is storage.StorageObject
+    assert snakemake_storage_plugin_ee.StorageProviderSettings is \
+        storage.StorageProviderSettings
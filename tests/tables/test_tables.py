@@ -0,0 +1,56 @@
+import os
+
+import pytest
+
+from geemake import fake, tables, utils
+
+EE_PREFIX = 'users/geemake/fake-tests/'
+
+pytestmark = pytest.mark.usefixtures('fake_ee')
+
+
+def test_iter_features_pages_through_table():
+    features = [
+        {'type': 'Feature', 'id': str(i), 'properties': {'value': i},
+         'geometry': {'type': 'Point', 'coordinates': [i, i]}}
+        for i in range(25)
+    ]
+    fake.create_asset(EE_PREFIX + 'table', features=features)
+
+    pages = list(tables.iter_features(EE_PREFIX + 'table', page_size=10))
+
+    assert [len(x) for x in pages] == [10, 10, 5]
+    assert [x for page in pages for x in page] == features
+    assert fake.call_counts() == {'listFeatures': 3}
+
+
+def test_to_parquet_writes_a_row_group_per_page(tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+    features = [
+        {'type': 'Feature', 'id': str(i),
+         'properties': {'name': f'city-{i}', 'population': i * 1000},
+         'geometry': {'type': 'Point', 'coordinates': [i, i]}}
+        for i in range(25)
+    ]
+    fake.create_asset(EE_PREFIX + 'table', features=features)
+    os.makedirs('.local')
+    utils.write_update_time(EE_PREFIX + 'table', '.local/table')
+
+    path = str(tmp_path / 'table.parquet')
+    assert tables.to_parquet('.local/table', path, page_size=10) == 25
+
+    parquet = pq.ParquetFile(path)
+    assert parquet.num_row_groups == 3
+    table = parquet.read()
+    # whole numbers are not turned into doubles
+    assert str(table.schema.field('population').type) == 'int64'
+    assert table.column('population').to_pylist() == \
+        [i * 1000 for i in range(25)]
+    assert table.column('system:index').to_pylist()[0] == '0'
+
+    # a fraction after the first page is not truncated
+    features[20]['properties']['population'] = 0.5
+    fake.create_asset(EE_PREFIX + 'fractions', features=features)
+    with pytest.raises(ValueError, match='population'):
+        tables.to_parquet(EE_PREFIX + 'fractions', path, page_size=10)
+    assert pq.read_table(path).num_rows == 25
@@ -0,0 +1,159 @@
+import random
+import time
+
+import pytest
+
+import ee
+
+from geemake import cache, fake, quota, tasks
+
+EE_PREFIX = 'users/geemake/fake-tests/'
+
+pytestmark = pytest.mark.usefixtures('fake_ee')
+
+
+def test_monitor_waits_for_every_task():
+    started = {}
+    for i in range(3):
+        task = ee.batch.Export.table.toAsset(
+            collection=ee.FeatureCollection(EE_PREFIX + 'input'),
+            description=f'task-{i}',
+            assetId=EE_PREFIX + f'output-{i}',
+        )
+        task.start()
+        started[task.id] = EE_PREFIX + f'output-{i}'
+
+    finished = {}
+
+    def on_finish(asset, state, runtime):
+        finished[asset] = state
+
+    start = time.time()
+    tasks.monitor(started, 0, on_finish, max_wait=1)
+
+    assert time.time() - start < 5
+    assert finished == {x: 'COMPLETED' for x in started.values()}
+    assert all(ee.data.getAsset(x) for x in started.values())
+
+
+def test_monitor_starts_queued_tasks_within_quota():
+    quota.configure({'ee_max_tasks': 2})
+    queued = []
+    for i in range(5):
+        task = ee.batch.Export.table.toAsset(
+            collection=ee.FeatureCollection(EE_PREFIX + 'input'),
+            assetId=EE_PREFIX + f'output-{i}',
+        )
+        queued.append((quota.enqueue(), task))
+
+    running = set()
+    most_running = [0]
+
+    def start(item):
+        ticket, task = item
+        if not quota.try_acquire(ticket):
+            return None
+        task.start()
+        running.add(ticket)
+        most_running[0] = max(most_running[0], len(running))
+        return task.id
+
+    def on_finish(item, state, runtime):
+        running.discard(item[0])
+        quota.release(item[0])
+
+    tasks.monitor({}, 0, on_finish, max_wait=0.5, queued=queued, start=start)
+    quota.configure({})
+
+    assert most_running[0] == 2
+    assert not running
+
+
+def test_monitor_resumes_task_started_earlier():
+    task = ee.batch.Export.table.toAsset(
+        collection=ee.FeatureCollection(EE_PREFIX + 'input'),
+        assetId=EE_PREFIX + 'output',
+    )
+    task.start()
+    cache.put_submitted(EE_PREFIX + 'output', task.id, 'abc', time.time())
+    task_id, fingerprint, started = \
+        cache.get_submitted([EE_PREFIX + 'output'])[EE_PREFIX + 'output']
+    assert (task_id, fingerprint) == (task.id, 'abc')
+
+    runtimes = {}
+
+    def on_finish(asset, state, runtime):
+        runtimes[asset] = runtime
+        cache.remove_submitted(asset)
+
+    # as if started by a run that was interrupted 100 seconds ago
+    tasks.monitor({task_id: EE_PREFIX + 'output'}, 0, on_finish, max_wait=0.5,
+                  started_at={task_id: started - 100})
+
+    assert runtimes[EE_PREFIX + 'output'] >= 100
+    assert cache.get_submitted([EE_PREFIX + 'output']) == {}
+
+
+def test_monitor_consumes_queued_generator_within_window():
+    consumed = []
+
+    def exports():
+        for i in range(12):
+            consumed.append(i)
+            yield ee.batch.Export.table.toAsset(
+                collection=ee.FeatureCollection(EE_PREFIX + 'input'),
+                assetId=EE_PREFIX + f'output-{i}',
+            )
+
+    running = set()
+    finished = []
+    most_running = [0]
+
+    def start(task):
+        # the generator is only advanced once there is room for its task
+        assert len(consumed) == len(running) + len(finished) + 1
+        task.start()
+        running.add(task.id)
+        most_running[0] = max(most_running[0], len(running))
+        return task.id
+
+    def on_finish(task, state, runtime):
+        running.discard(task.id)
+        finished.append(task.id)
+
+    tasks.monitor({}, 0, on_finish, max_wait=0.5, queued=exports(),
+                  start=start, window=4)
+
+    assert most_running[0] == 4
+    assert len(finished) == 12 and not running
+
+
+def test_monitor_backs_off_up_to_max_wait(monkeypatch):
+    # a clock that only moves when monitor sleeps, without jitter
+    clock = [time.time()]
+    waits = []
+
+    def sleep(seconds):
+        waits.append(seconds)
+        clock[0] += seconds
+    monkeypatch.setattr(time, 'time', lambda: clock[0])
+    monkeypatch.setattr(time, 'sleep', sleep)
+    monkeypatch.setattr(random, 'uniform', lambda a, b: b)
+
+    assert [tasks.backoff(i, 2, max_wait=10) for i in range(6)] == \
+        [2, 3, 4.5, 6.75, 10, 10]
+    assert tasks.backoff(1, 0.1, max_wait=10) == tasks.MIN_WAIT * 1.5
+
+    fake.configure({**fake.options(), 'task_duration': 20})
+    task = ee.batch.Export.table.toAsset(
+        collection=ee.FeatureCollection(EE_PREFIX + 'input'),
+        assetId=EE_PREFIX + 'output',
+    )
+    task.start()
+    finished = []
+    tasks.monitor({task.id: EE_PREFIX + 'output'}, 2,
+                  lambda *args: finished.append(args), max_wait=10)
+
+    # the task finishes 20 seconds in and is seen at the first check after
+    assert waits == [2, 3, 4.5, 6.75, 10]
+    assert finished == [(EE_PREFIX + 'output', 'COMPLETED', 26.25)]
@@ -0,0 +1,80 @@
+import os
+
+import pytest
+
+import ee
+
+from geemake import cache, fake, utils
+
+EE_PREFIX = 'users/geemake/fake-tests/'
+
+pytestmark = pytest.mark.usefixtures('fake_ee')
+
+
+def test_task_fingerprint_depends_on_expression_and_inputs():
+    def export(name):
+        return ee.batch.Export.table.toAsset(
+            collection=ee.FeatureCollection(EE_PREFIX + name).limit(10),
+            description='task',
+            assetId=EE_PREFIX + 'output',
+        )
+
+    fingerprint = utils.task_fingerprint(export('a'), {EE_PREFIX + 'a': 1.0})
+
+    assert fingerprint == \
+        utils.task_fingerprint(export('a'), {EE_PREFIX + 'a': 1.0})
+    assert fingerprint != \
+        utils.task_fingerprint(export('b'), {EE_PREFIX + 'a': 1.0})
+    assert fingerprint != \
+        utils.task_fingerprint(export('a'), {EE_PREFIX + 'a': 2.0})
+
+    cache.put_fingerprint(EE_PREFIX + 'output', fingerprint, 1000.0)
+    assert cache.get_fingerprints([EE_PREFIX + 'output', EE_PREFIX + 'x']) \
+        == {EE_PREFIX + 'output': (fingerprint, 1000.0)}
+
+
+def test_outputs_are_shared_through_the_cache_folder(capsys, run_wrapper):
+    cache_prefix = EE_PREFIX + 'shared'
+    config = {'ee_prefix': EE_PREFIX, 'local_prefix': '.local/',
+              'ee_cache_prefix': cache_prefix}
+    fake.create_asset(EE_PREFIX + 'input')
+    os.makedirs('.local')
+    utils.write_update_time(EE_PREFIX + 'input', '.local/input')
+
+    # a miss exports the output and publishes it under its fingerprint
+    run_wrapper('export', ['.local/input'], ['.local/output'], config)
+    fingerprint, _ = cache.get_fingerprints([EE_PREFIX + 'output'])[
+        EE_PREFIX + 'output'
+    ]
+    assert len(ee.data.getTaskList()) == 1
+    assert utils.get_update_time(f'{cache_prefix}/{fingerprint}') is not None
+
+    # another run with the same fingerprint copies it instead of exporting
+    ee.data.deleteAsset(EE_PREFIX + 'output')
+    os.remove('.local/output')
+    run_wrapper('export', ['.local/input'], ['.local/output'], config)
+    assert len(ee.data.getTaskList()) == 1
+    assert utils.get_update_time(EE_PREFIX + 'output') is not None
+    assert os.path.isfile('.local/output')
+    assert f'Copying {EE_PREFIX}output from {cache_prefix}/{fingerprint}' \
+        in capsys.readouterr().out
+
+    # the output is kept when it cannot be published
+    fake.create_asset(EE_PREFIX + 'other-input')
+    utils.write_update_time(EE_PREFIX + 'other-input', '.local/other-input')
+    copy_asset = ee.data.copyAsset
+
+    def refuse_publishing(source, destination, *args, **kwargs):
+        if destination.startswith(cache_prefix):
+            raise ee.EEException(f'Permission denied on {destination}.')
+        return copy_asset(source, destination, *args, **kwargs)
+    ee.data.copyAsset = refuse_publishing
+    try:
+        run_wrapper('export', ['.local/other-input'], ['.local/other'],
+                     config)
+    finally:
+        ee.data.copyAsset = copy_asset
+    assert len(ee.data.getTaskList()) == 2
+    assert os.path.isfile('.local/other')
+    assert f'Could not publish {EE_PREFIX}other to {cache_prefix}' in \
+        capsys.readouterr().out